@@ -0,0 +1,32 @@
+"""add vote_count to posts
+
+Revision ID: 3b9d2f6a1c47
+Revises: fa01a913b88f
+Create Date: 2026-10-18 09:12:41.204518
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3b9d2f6a1c47'
+down_revision: Union[str, None] = 'fa01a913b88f'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('posts', sa.Column('vote_count', sa.Integer(), nullable=False, server_default='0'))
+    # Backfill the counter for the votes that already exist.
+    op.execute("UPDATE posts SET vote_count = (SELECT count(*) FROM votes WHERE votes.post_id = posts.id)")
+    pass
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('posts', 'vote_count')
+    pass
@@ -0,0 +1,38 @@
+"""add full text search index on posts
+
+Revision ID: 7c1e5a9d4b20
+Revises: 3b9d2f6a1c47
+Create Date: 2026-10-18 11:02:15.873120
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7c1e5a9d4b20'
+down_revision: Union[str, None] = '3b9d2f6a1c47'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+'''
+CONCURRENTLY so that posts stay writable while the index is built (a GIN index over all the text takes a while).
+It is not allowed inside a transaction, that's why the autocommit_block (like in d41f8b3e6a92).
+'''
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Expression index: the expression must be the same as app.search.post_document.
+    with op.get_context().autocommit_block():
+        op.execute("CREATE INDEX CONCURRENTLY ix_posts_search ON posts USING gin (to_tsvector('english', title || ' ' || content))")
+    pass
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_posts_search', table_name='posts', postgresql_concurrently=True)
+    pass
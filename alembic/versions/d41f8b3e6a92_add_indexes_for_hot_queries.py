@@ -0,0 +1,42 @@
+"""add indexes for hot queries
+
+Revision ID: d41f8b3e6a92
+Revises: 7c1e5a9d4b20
+Create Date: 2026-10-18 12:26:48.519306
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd41f8b3e6a92'
+down_revision: Union[str, None] = '7c1e5a9d4b20'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+'''
+The indexes are created CONCURRENTLY so that the tables stay writable while they are built on a live database.
+CREATE INDEX CONCURRENTLY is not allowed inside a transaction, that's why the autocommit_block.
+If a concurrent build fails it leaves an INVALID index behind: drop it and run the migration again.
+'''
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    with op.get_context().autocommit_block():
+        op.create_index('ix_votes_post_id', 'votes', ['post_id'], postgresql_concurrently=True)
+        op.create_index('ix_posts_owner_id', 'posts', ['owner_id'], postgresql_concurrently=True)
+        op.create_index('ix_posts_created_at_id', 'posts', ['created_at', 'id'], postgresql_concurrently=True)
+    pass
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_posts_created_at_id', table_name='posts', postgresql_concurrently=True)
+        op.drop_index('ix_posts_owner_id', table_name='posts', postgresql_concurrently=True)
+        op.drop_index('ix_votes_post_id', table_name='votes', postgresql_concurrently=True)
+    pass
@@ -0,0 +1,35 @@
+"""add updated_at to posts and users
+
+Revision ID: e8a2c7f05b13
+Revises: d41f8b3e6a92
+Create Date: 2026-10-18 13:40:07.662841
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e8a2c7f05b13'
+down_revision: Union[str, None] = 'd41f8b3e6a92'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('posts', sa.Column('updated_at', sa.TIMESTAMP(timezone=True), nullable=False, server_default=sa.text('now()')))
+    op.add_column('users', sa.Column('updated_at', sa.TIMESTAMP(timezone=True), nullable=False, server_default=sa.text('now()')))
+    # Rows that existed before haven't been changed since they were created, as far as we know.
+    op.execute("UPDATE posts SET updated_at = created_at")
+    op.execute("UPDATE users SET updated_at = created_at")
+    pass
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('users', 'updated_at')
+    op.drop_column('posts', 'updated_at')
+    pass
@@ -0,0 +1,35 @@
+"""add email prefix index to users
+
+Revision ID: f3c9a1d27e64
+Revises: e8a2c7f05b13
+Create Date: 2026-10-18 15:02:31.417305
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f3c9a1d27e64'
+down_revision: Union[str, None] = 'e8a2c7f05b13'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Built CONCURRENTLY like the indexes of d41f8b3e6a92, so the users table stays writable (and logins keep working).
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    with op.get_context().autocommit_block():
+        op.create_index('ix_users_email_pattern', 'users', ['email'], postgresql_ops={'email': 'text_pattern_ops'},
+                        postgresql_concurrently=True)
+    pass
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_users_email_pattern', table_name='users', postgresql_concurrently=True)
+    pass
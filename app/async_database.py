@@ -0,0 +1,48 @@
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from app.config import settings
+from app.database import pool_options, pools, CheckoutTiming
+
+# Same database as app/database.py but through the asyncpg driver.
+SQLALCHEMY_ASYNC_DATABASE_URL = f"postgresql+asyncpg://{settings.database_username}:{settings.database_password}@{settings.database_hostname}:{settings.database_port}/{settings.database_name}"
+
+
+'''With the sync engine every request holds a threadpool worker while it waits for postgres,
+so the number of requests we can serve at the same time is limited by the size of the threadpool.
+With the async engine the request gives the event loop back while it waits for the database,
+so one worker can keep many requests in flight.
+
+The engine is only created by init_async_engine() (called from main.py when DATABASE_ASYNC=true),
+so the sync stack keeps working even if asyncpg is not installed.
+'''
+async_engine = None
+
+
+# The default pool of create_async_engine, with the checkout wait times of app/database.py.
+class InstrumentedAsyncQueuePool(CheckoutTiming, AsyncAdaptedQueuePool):
+    pass
+
+# expire_on_commit=False because after commit we can't lazy load the attributes again
+# without awaiting, and the response models read them after the handler returns.
+AsyncSessionLocal = sessionmaker(class_=AsyncSession, autocommit=False, autoflush=False, expire_on_commit=False)
+
+
+def init_async_engine():
+    global async_engine
+    if async_engine is None:
+        async_engine = create_async_engine(SQLALCHEMY_ASYNC_DATABASE_URL, poolclass=InstrumentedAsyncQueuePool, **pool_options)
+        AsyncSessionLocal.configure(bind=async_engine)
+        pools["async"] = async_engine.sync_engine.pool
+    return async_engine
+
+
+async def dispose_async_engine():
+    if async_engine is not None:
+        await async_engine.dispose()
+
+
+# Dependency
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
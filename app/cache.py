@@ -0,0 +1,112 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+from app.config import settings
+
+'''
+Caches used to skip repeated database work.
+
+TTLCache keeps the values in the memory of the worker process: it is the fastest option, but every uvicorn worker
+has its own copy, so a delete in one worker doesn't reach the others until the entries expire.
+RedisCache keeps the values in redis, shared by all the workers. It is used when CACHE_REDIS_URL is set
+(pip install redis). Values stored in a cache must be JSON serializable so that both backends can store them.
+'''
+
+caches = {}   # every cache by name, for the /internal/cache endpoint and to clear them between tests.
+
+
+class TTLCache:
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()   # key -> (expires_at, value), least recently used first
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None and item[0] <= time.monotonic():
+                del self._data[key]
+                item = None
+            if item is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def set(self, key, value, ttl: float = None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)   # drop the least recently used entry
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        return {"backend": "memory", "size": len(self._data), **hit_rate(self.hits, self.misses)}
+
+
+class RedisCache:
+    def __init__(self, name: str, url: str, ttl: float):
+        import redis   # optional dependency, only needed when CACHE_REDIS_URL is set.
+        self._redis = redis.Redis.from_url(url)
+        self.prefix = f"fastapi:{name}:"
+        self.ttl = ttl
+        self.hits = 0    # hits and misses of this worker only
+        self.misses = 0
+
+    def get(self, key):
+        raw = self._redis.get(f"{self.prefix}{key}")
+        if raw is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(raw)
+
+    def set(self, key, value, ttl: float = None):
+        milliseconds = int((self.ttl if ttl is None else ttl) * 1000)
+        if milliseconds > 0:
+            self._redis.set(f"{self.prefix}{key}", json.dumps(value), px=milliseconds)
+
+    def delete(self, key):
+        self._redis.delete(f"{self.prefix}{key}")
+
+    def clear(self):
+        keys = list(self._redis.scan_iter(match=f"{self.prefix}*"))
+        if keys:
+            self._redis.delete(*keys)
+
+    def stats(self):
+        return {"backend": "redis", **hit_rate(self.hits, self.misses)}
+
+
+def hit_rate(hits, misses):
+    total = hits + misses
+    return {"hits": hits, "misses": misses, "hit_rate": hits / total if total else 0.0}
+
+
+# shared=False keeps the cache in process memory even when redis is configured.
+def build_cache(name: str, maxsize: int, ttl: float, shared: bool = True):
+    if shared and settings.cache_redis_url:
+        cache = RedisCache(name, settings.cache_redis_url, ttl)
+    else:
+        cache = TTLCache(maxsize, ttl)
+    caches[name] = cache
+    return cache
+
+
+def clear_all():
+    for cache in caches.values():
+        cache.clear()
@@ -0,0 +1,41 @@
+import hashlib
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from fastapi import Request, Response, status
+
+'''
+Conditional GET (ETag / Last-Modified).
+
+Every response of a post or user carries an ETag (a hash of the row version: id, updated_at and, for posts,
+the vote count) and a Last-Modified (updated_at). A client that already has the resource sends them back as
+If-None-Match / If-Modified-Since; when nothing changed we answer 304 Not Modified with an empty body,
+so we neither serialize nor send the JSON again.
+'''
+
+
+def make_validators(updated_at: datetime, *version):
+    etag = hashlib.sha1(repr((updated_at.isoformat(),) + version).encode()).hexdigest()
+    return {
+        "ETag": f'"{etag}"',
+        "Last-Modified": format_datetime(updated_at.astimezone(timezone.utc), usegmt=True),
+    }
+
+
+def is_not_modified(request: Request, validators: dict):
+    # If-None-Match wins over If-Modified-Since when the client sends both.
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        etags = [etag.strip().removeprefix("W/") for etag in if_none_match.split(",")]
+        return "*" in etags or validators["ETag"] in etags
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since is not None:
+        try:
+            return parsedate_to_datetime(validators["Last-Modified"]) <= parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):   # a date we can't parse is ignored, like the RFC says.
+            return False
+    return False
+
+
+def not_modified_response(validators: dict):
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=validators)
@@ -0,0 +1,46 @@
+from fastapi.responses import StreamingResponse
+from app.config import settings
+from app.serializers import dump_ndjson
+
+'''
+GET /posts/export and GET /users/export send the whole table as NDJSON (one JSON object per line).
+
+The rows are not loaded with .all(): the query runs on a server-side cursor (yield_per / AsyncSession.stream), so the
+database sends export_chunk_size rows at a time, and every chunk is turned into NDJSON and sent to the client before
+the next one is fetched. The memory used is the same for 100 rows or 100 million.
+
+FastAPI closes the dependencies (get_db) before a StreamingResponse starts sending its body, so the generators here
+keep using the session of the request (it opens a new connection when used after close) and close it themselves
+at the end, also when the client disconnects in the middle.
+'''
+
+
+def stream_query(db, query, build):
+    try:
+        chunk = []
+        for row in query.yield_per(settings.export_chunk_size):   # yield_per also turns on stream_results (server-side cursor)
+            chunk.append(row)
+            if len(chunk) == settings.export_chunk_size:
+                yield dump_ndjson(chunk, build)
+                chunk = []
+        if chunk:
+            yield dump_ndjson(chunk, build)
+    finally:
+        db.close()
+
+
+async def stream_select(db, statement, build):
+    try:
+        result = await db.stream(statement)
+        async for rows in result.partitions(settings.export_chunk_size):
+            yield dump_ndjson(rows, build)
+    finally:
+        await db.close()
+
+
+def ndjson_response(chunks, filename: str):
+    return StreamingResponse(
+        chunks,
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
@@ -0,0 +1,136 @@
+import asyncio
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from fastapi import HTTPException, status
+from fastapi.concurrency import run_in_threadpool
+from app import utils
+from app.config import settings
+from app import metrics
+
+'''
+bcrypt takes a few hundred milliseconds of CPU per password on purpose. Done inside the request it keeps a worker busy
+for that long, and a burst of logins slows down every other endpoint. So the hashing runs in a small pool of separate
+processes instead, and only a limited number of passwords can wait for it: once the pool and the queue are full
+we answer 503 right away instead of letting the requests pile up.
+When a process of the pool dies (e.g. killed by the OOM killer) the pool is "broken" and fails every job from then on,
+so it is replaced by a new one and the password is hashed again.
+'''
+
+# Seconds per password, waiting for a free process included, for /metrics.
+hash_seconds = metrics.histogram("password_hash_seconds", "Seconds to hash or verify a password, waiting included.", ["operation"],
+                                 buckets=[0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10])
+
+
+class PasswordHasher:
+    def __init__(self, workers: int, queue_limit: int):
+        self.workers = workers     # 0 hashes in the calling thread (no process pool), e.g. for debugging.
+        self._slots = threading.BoundedSemaphore(max(workers, 1) + queue_limit)   # passwords being hashed + waiting
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                # spawn instead of fork: forking a process that is running threads (the server) is not safe.
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+            return self._executor
+
+    def _discard_executor(self, executor):
+        with self._lock:
+            if self._executor is executor:   # another thread may have replaced it already
+                self._executor = None
+        executor.shutdown(wait=False)
+
+    def _acquire_slot(self):
+        if not self._slots.acquire(blocking=False):
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Too many requests are waiting for password hashing, try again later.",
+                headers={"Retry-After": "1"}
+            )
+
+    def _submit(self, function, *args):
+        self._acquire_slot()
+        try:
+            executor = self._get_executor()
+            try:
+                future = executor.submit(function, *args)
+            except BrokenProcessPool:
+                self._discard_executor(executor)
+                future = self._get_executor().submit(function, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def _run(self, function, *args):
+        start = time.perf_counter()
+        try:
+            return self._run_untimed(function, *args)
+        finally:
+            hash_seconds.labels(function.__name__).observe(time.perf_counter() - start)
+
+    async def _run_async(self, function, *args):
+        start = time.perf_counter()
+        try:
+            return await self._run_async_untimed(function, *args)
+        finally:
+            hash_seconds.labels(function.__name__).observe(time.perf_counter() - start)
+
+    def _run_untimed(self, function, *args):
+        if self.workers == 0:
+            self._acquire_slot()
+            try:
+                return function(*args)
+            finally:
+                self._slots.release()
+        try:
+            return self._submit(function, *args).result()
+        except BrokenProcessPool:
+            # The pool broke while it had our job. Submitting again replaces it (see _submit).
+            return self._submit(function, *args).result()
+
+    async def _run_async_untimed(self, function, *args):
+        if self.workers == 0:
+            self._acquire_slot()
+            try:
+                return await run_in_threadpool(function, *args)
+            finally:
+                self._slots.release()
+        try:
+            return await asyncio.wrap_future(self._submit(function, *args))
+        except BrokenProcessPool:
+            return await asyncio.wrap_future(self._submit(function, *args))
+
+    # For the sync routes: the thread waits for the pool, but the CPU work happens in the other process.
+    def hash(self, password: str):
+        return self._run(utils.hash, password)
+
+    def verify(self, plain_password: str, hashed_password: str):
+        return self._run(utils.verify, plain_password, hashed_password)
+
+    def verify_and_update(self, plain_password: str, hashed_password: str):
+        return self._run(utils.verify_and_update, plain_password, hashed_password)
+
+    # For the async routes: the event loop keeps serving other requests while the pool works.
+    async def hash_async(self, password: str):
+        return await self._run_async(utils.hash, password)
+
+    async def verify_async(self, plain_password: str, hashed_password: str):
+        return await self._run_async(utils.verify, plain_password, hashed_password)
+
+    async def verify_and_update_async(self, plain_password: str, hashed_password: str):
+        return await self._run_async(utils.verify_and_update, plain_password, hashed_password)
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+
+password_hasher = PasswordHasher(settings.password_hash_workers, settings.password_hash_queue_limit)
@@ -1,7 +1,15 @@
 from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
 from app import models
 from app.database import engine
-from app.routers import post, user, auth, vote
+from app.config import settings
+from app import async_database
+from app.routers import internal
+from app.routers import metrics as metrics_router
+from app.hashing import password_hasher
+from app import profiling
+from app import metrics
+from app import rate_limit
 from fastapi.middleware.cors import CORSMiddleware
 
 '''
@@ -18,25 +26,72 @@ from app.routers import post, user
 # The bind parameter is the database engine to use to connect to the database.
 
 
-app = FastAPI()
+# DATABASE_ASYNC=true serves the same routes from the async (asyncpg) routers, otherwise the sync ones are used.
+# The tests build both apps, to run the same tests against both stacks.
+def create_app(database_async: bool):
+    if database_async:
+        from app.routers import async_post as post, async_user as user, async_auth as auth, async_vote as vote
+    else:
+        from app.routers import post, user, auth, vote
 
-origins = ["*"]
+    app = FastAPI(default_response_class=ORJSONResponse)   # orjson is a lot faster than the json module of the standard library.
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=origins,
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+    @app.on_event("shutdown")
+    def stop_password_hasher():
+        password_hasher.shutdown()
 
+    @app.on_event("startup")
+    def reset_metrics():
+        metrics.reset_for_new_master()
 
-@app.get("/")     # This is the root route and it will execute when we write {{URL}} in the postman.
-def root():
-    return {"message": "Hello World"}
+    @app.on_event("shutdown")
+    def flush_metrics():
+        metrics.flush(force=True)   # so the requests served since the last flush are not lost (only with metrics_dir)
 
-app.include_router(post.router)
-app.include_router(user.router)
-app.include_router(auth.router)
-app.include_router(vote.router)
+    if database_async:
+        async_database.init_async_engine()
 
+        @app.on_event("shutdown")
+        async def close_async_engine():
+            await async_database.dispose_async_engine()
+
+    # Added before CORSMiddleware so it runs inside it, and the 429 responses get the CORS headers too (or browsers can't read them).
+    if settings.rate_limit_enabled:
+        app.add_middleware(rate_limit.RateLimitMiddleware)
+
+    origins = ["*"]
+
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=origins,
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+        expose_headers=["X-Next-Cursor", "X-Total-Count", "X-Total-Count-Estimated", "ETag", "Last-Modified"],   # browsers only let javascript read the headers listed here.
+    )
+
+    if settings.sql_profiling_enabled:
+        profiling.configure_logger()
+        profiling.instrument_engine(engine)
+        if database_async:
+            profiling.instrument_engine(async_database.async_engine.sync_engine)
+        app.add_middleware(profiling.SQLProfilingMiddleware)
+
+    if settings.metrics_enabled:
+        app.add_middleware(metrics.MetricsMiddleware)
+
+    @app.get("/")     # This is the root route and it will execute when we write {{URL}} in the postman.
+    def root():
+        return {"message": "Hello World"}
+
+    app.include_router(post.router)
+    app.include_router(user.router)
+    app.include_router(auth.router)
+    app.include_router(vote.router)
+    app.include_router(internal.router)
+    if settings.metrics_enabled:
+        app.include_router(metrics_router.router)
+    return app
+
+
+app = create_app(settings.database_async)
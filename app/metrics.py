@@ -0,0 +1,306 @@
+import fcntl
+import glob
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from starlette.concurrency import run_in_threadpool
+from app.config import settings
+
+'''
+Small thread safe metric types, and the registry behind the prometheus /metrics endpoint.
+Everything is kept in process memory, so we don't need any external service to see what the app is doing.
+
+Every metric is a family with a name, a help text and label names (e.g. method, route); family.labels(...) returns
+the Counter / Gauge / Histogram for one combination of label values.
+
+Multiple uvicorn workers: every worker process has its own numbers. When METRICS_DIR is set, every worker writes its
+numbers to METRICS_DIR/metrics-<pid>-<start time>.json (at most every metrics_flush_interval seconds, when it serves
+a request, in a thread so the event loop doesn't wait for the disk), and /metrics adds up the files of all the workers,
+so it doesn't matter which worker answers the scrape.
+- Counters and histograms of workers that exited are kept (counters never go down), their gauges are dropped.
+- The start time of the process is part of the file name and of the "is it alive" check, so a new worker that gets
+  the pid of a dead one doesn't overwrite its file, and the dead one's gauges aren't counted as alive.
+- The files belong to the uvicorn master process (the parent of the workers). The first worker of a new master
+  (a restart or a new deploy) deletes the files of the previous one, see reset_for_new_master().
+'''
+
+DEFAULT_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+
+
+class Counter:
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def snapshot(self):
+        return self.value
+
+
+class Gauge(Counter):
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+    def set(self, value):
+        with self._lock:
+            self.value = value
+
+
+# Histogram with fixed buckets, like prometheus: a value is counted in every bucket whose upper bound is >= value.
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = sorted(buckets)
+        self.bucket_counts = [0] * (len(self.buckets) + 1)   # the last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            self.bucket_counts[index] += 1
+            self.count += 1
+            self.sum += value
+
+    def snapshot(self):
+        with self._lock:
+            bucket_counts = list(self.bucket_counts)
+            count, total = self.count, self.sum
+        cumulative, buckets = 0, {}
+        for upper_bound, bucket_count in zip(self.buckets + ["+Inf"], bucket_counts):
+            cumulative += bucket_count
+            buckets[str(upper_bound)] = cumulative
+        return {"buckets": buckets, "count": count, "sum": total}
+
+
+class MetricFamily:
+    def __init__(self, name, help, kind, labelnames, create):
+        self.name = name
+        self.help = help
+        self.kind = kind    # counter, gauge or histogram
+        self.labelnames = tuple(labelnames)
+        self._create = create
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._create())
+        return child
+
+    def snapshot(self):
+        return {
+            "help": self.help,
+            "kind": self.kind,
+            "labelnames": self.labelnames,
+            "samples": [[list(values), child.snapshot()] for values, child in list(self._children.items())],
+        }
+
+
+registry = {}
+collectors = []   # functions called before every scrape, to update gauges that are read from somewhere else (e.g. the pool)
+
+
+def _register(family):
+    registry[family.name] = family
+    return family
+
+
+def counter(name, help, labelnames=()):
+    return _register(MetricFamily(name, help, "counter", labelnames, Counter))
+
+
+def gauge(name, help, labelnames=()):
+    return _register(MetricFamily(name, help, "gauge", labelnames, Gauge))
+
+
+def histogram(name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+    return _register(MetricFamily(name, help, "histogram", labelnames, lambda: Histogram(buckets)))
+
+
+# Start time of a process, in clock ticks since the boot (field 22 of /proc/<pid>/stat). With the pid it identifies
+# the process, even after the pid is reused. None without /proc.
+def _process_start(pid):
+    try:
+        with open(f"/proc/{pid}/stat") as file:
+            return int(file.read().rsplit(")", 1)[1].split()[19])   # after the command name (in parentheses) is field 3
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def snapshot():
+    for collect in collectors:
+        collect()
+    return {"pid": os.getpid(), "started": _process_start(os.getpid()),
+            "metrics": {name: family.snapshot() for name, family in registry.items()}}
+
+
+# ---- multiprocess support ----
+
+_last_flush = 0.0
+_flush_lock = threading.Lock()
+
+
+def flush_due():
+    return bool(settings.metrics_dir) and time.monotonic() - _last_flush >= settings.metrics_flush_interval
+
+
+def flush(force=False):
+    global _last_flush
+    if not settings.metrics_dir:
+        return
+    # One flush at a time (they write the same file); a flush that is not forced is skipped if another one is running.
+    if not _flush_lock.acquire(blocking=force):
+        return
+    try:
+        now = time.monotonic()
+        if not force and now - _last_flush < settings.metrics_flush_interval:
+            return
+        _last_flush = now
+        path = os.path.join(settings.metrics_dir, f"metrics-{os.getpid()}-{_process_start(os.getpid())}.json")
+        with open(f"{path}.tmp", "w") as file:
+            json.dump(snapshot(), file)
+        os.replace(f"{path}.tmp", path)   # atomic, so a scrape never reads a half written file
+    finally:
+        _flush_lock.release()
+
+
+# Called by every worker when it starts. The workers of one master have its pid as parent pid: when the master
+# written in METRICS_DIR/master is another one, the files are from a previous run of the server, and summing them
+# forever would mix the numbers of old deploys with ours. The lock makes the workers starting together do it once.
+def reset_for_new_master():
+    if not settings.metrics_dir:
+        return
+    master = f"{os.getppid()}-{_process_start(os.getppid())}"
+    with open(os.path.join(settings.metrics_dir, "master"), "a+") as marker:
+        fcntl.flock(marker, fcntl.LOCK_EX)   # released when the file is closed
+        marker.seek(0)
+        if marker.read() == master:
+            return
+        for path in glob.glob(os.path.join(settings.metrics_dir, "metrics-*.json")):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        marker.seek(0)
+        marker.truncate()
+        marker.write(master)
+
+
+def _process_alive(pid, started=None):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    # The pid exists, but it can be a new process that got the pid of the dead worker.
+    current_start = _process_start(pid)
+    return started is None or current_start is None or current_start == started
+
+
+def _worker_snapshots():
+    if not settings.metrics_dir:
+        return [snapshot()]
+    flush(force=True)
+    snapshots = []
+    for path in glob.glob(os.path.join(settings.metrics_dir, "metrics-*.json")):
+        try:
+            with open(path) as file:
+                snapshots.append(json.load(file))
+        except (OSError, ValueError):   # the file of a worker that is starting or was just removed
+            continue
+    return snapshots
+
+
+def _merge(snapshots):
+    merged = {}
+    for worker in snapshots:
+        alive = _process_alive(worker["pid"], worker.get("started"))
+        for name, family in worker["metrics"].items():
+            if family["kind"] == "gauge" and not alive:
+                continue
+            target = merged.setdefault(name, {**family, "samples": {}})
+            for values, value in family["samples"]:
+                key = tuple(values)
+                if family["kind"] == "histogram":
+                    total = target["samples"].setdefault(key, {"buckets": {}, "count": 0, "sum": 0.0})
+                    for upper_bound, count in value["buckets"].items():
+                        total["buckets"][upper_bound] = total["buckets"].get(upper_bound, 0) + count
+                    total["count"] += value["count"]
+                    total["sum"] += value["sum"]
+                else:
+                    target["samples"][key] = target["samples"].get(key, 0) + value
+    return merged
+
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+# Prometheus text exposition format.
+def render():
+    lines = []
+    for name, family in sorted(_merge(_worker_snapshots()).items()):
+        lines.append(f"# HELP {name} {family['help']}")
+        lines.append(f"# TYPE {name} {family['kind']}")
+        for values, value in family["samples"].items():
+            if family["kind"] == "histogram":
+                for upper_bound, count in value["buckets"].items():
+                    lines.append(f"{name}_bucket{_format_labels(family['labelnames'], values, [('le', upper_bound)])} {count}")
+                lines.append(f"{name}_sum{_format_labels(family['labelnames'], values)} {value['sum']}")
+                lines.append(f"{name}_count{_format_labels(family['labelnames'], values)} {value['count']}")
+            else:
+                lines.append(f"{name}{_format_labels(family['labelnames'], values)} {value}")
+    return "\n".join(lines) + "\n"
+
+
+# ---- HTTP metrics ----
+
+http_requests_total = counter("http_requests_total", "Requests served, by route and status code.", ["method", "route", "status"])
+http_request_duration_seconds = histogram("http_request_duration_seconds", "Time to serve a request, by route.", ["method", "route"])
+http_requests_in_flight = gauge("http_requests_in_flight", "Requests being served right now.").labels()
+
+
+# Plain ASGI middleware. The route label is the path template of the matched route (/posts/{id}, not /posts/12),
+# so the number of label values stays small.
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        http_requests_in_flight.inc()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            http_requests_in_flight.dec()
+            route = scope.get("route")
+            route_path = route.path if route is not None else "unmatched"
+            http_request_duration_seconds.labels(scope["method"], route_path).observe(time.perf_counter() - start)
+            http_requests_total.labels(scope["method"], route_path, str(status_code)).inc()
+            if flush_due():
+                await run_in_threadpool(flush)   # writing the file is blocking I/O, not for the event loop
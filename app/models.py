@@ -1,7 +1,7 @@
 from app.database import Base   # We are importing the Base class from the database module(file).
-from sqlalchemy import Column, Integer, String, Boolean, ForeignKey
+from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, Index, func
 from sqlalchemy.sql.sqltypes import TIMESTAMP
-from sqlalchemy.sql.expression import text
+from sqlalchemy.sql.expression import text, literal_column
 from sqlalchemy.orm import relationship
 
 
@@ -17,9 +17,23 @@ class Post(Base):
     content = Column(String, nullable=False)
     published = Column(Boolean, server_default='true') 
     created_at = Column(TIMESTAMP(timezone=True), nullable=False,server_default=text('now()'))
-    owner_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False )
+    owner_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True )   # index for "posts of a user" and the cascade when a user is deleted.
+    vote_count = Column(Integer, nullable=False, server_default='0')   # Kept in sync by the vote route so that reads don't have to count the votes table.
+    # onupdate sets it on every UPDATE of the row: update_post, patch_post and the vote_count changes of the vote route.
+    # It is the Last-Modified (and part of the ETag) of GET /posts/{id}.
+    updated_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=text('now()'), onupdate=func.now())
 
     owner = relationship("User")
+
+    # The feed is ordered by created_at, id (newest first). With this index postgres reads the posts
+    # already in that order and stops after limit rows (and jumps straight to a cursor) instead of sorting the whole table.
+    # ix_posts_search is the GIN index of the full text search (app/search.py, migration 7c1e5a9d4b20); its expression
+    # must stay the same as app.search.post_document. Declared here too so that create_all (the tests) builds it.
+    __table_args__ = (
+        Index("ix_posts_created_at_id", "created_at", "id"),
+        Index("ix_posts_search", func.to_tsvector(literal_column("'english'"), title + literal_column("' '") + content),
+              postgresql_using="gin"),
+    )
 '''In social media like platfrom we need to know the information (like username or email...)
 when retrieving the posts to know whose post is it. So sqlalchemy using relationship automatically establish a relationship
 and fetches some information from the refered class or something.
@@ -35,9 +49,16 @@ class User(Base):
     email = Column(String, nullable=False, unique=True)
     password = Column(String, nullable=False)
     created_at =Column(TIMESTAMP(timezone=True), nullable=False,server_default=text('now()'))
+    updated_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=text('now()'), onupdate=func.now())   # set by update_user
+
+    # For GET /users?email_prefix=... (email LIKE 'abc%'). The unique index of email can't be used for LIKE unless
+    # the database collation is "C"; text_pattern_ops compares the characters one by one, so it can.
+    __table_args__ = (Index("ix_users_email_pattern", "email", postgresql_ops={"email": "text_pattern_ops"}),)
 
 
 class Vote(Base):
     __tablename__="votes"
     user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
-    post_id = Column(Integer, ForeignKey("posts.id", ondelete="CASCADE"), primary_key=True)
\ No newline at end of file
+    post_id = Column(Integer, ForeignKey("posts.id", ondelete="CASCADE"), primary_key=True, index=True)
+    # The primary key (user_id, post_id) can only find votes by user. post_id needs its own index for
+    # "votes of a post" and for the cascade when a post is deleted.
\ No newline at end of file
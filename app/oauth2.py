@@ -1,11 +1,16 @@
+import time
 from jose import JWTError, jwt
 from datetime import datetime, timedelta, timezone
 from app import schemas, models
 from fastapi import status, HTTPException, Depends
 from fastapi.security import OAuth2PasswordBearer
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from app.database import get_db
+from app.async_database import get_async_db
 from app.config import settings
+from app.cache import build_cache
+from app import metrics
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
 
@@ -17,19 +22,36 @@ SECRET_KEY = settings.secret_key
 ALGORITHM = settings.algorithm
 ACCESS_TOKEN_EXPIRE_MINUTES = settings.access_token_expire_minutes
 
+# Time spent signing and checking tokens, for /metrics. Cached tokens (see token_cache) are not decoded, so not timed.
+jwt_seconds = metrics.histogram("jwt_seconds", "Seconds spent encoding or decoding a JWT.", ["operation"],
+                                buckets=[0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.05])
+
 def create_access_token(data: dict):
     to_encode= data.copy()
 
     expire= datetime.now(timezone.utc) + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     to_encode.update({"exp": expire})
+    start = time.perf_counter()
     encoded_jwt=jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    jwt_seconds.labels("encode").observe(time.perf_counter() - start)
     return encoded_jwt
     
 # we have made copy of the original data as to_encode because we will manupulate the 
 # data and we don't want our original data to change.
 
 
+# Tokens that have already been verified, so that a client sending the same token again doesn't pay for
+# jwt.decode (parsing, base64 decoding and checking the signature) on every request.
+# Every entry expires at the "exp" of its token, so an expired token is never accepted from the cache.
+# The raw token is a secret, so this cache always stays in the memory of the process.
+token_cache = build_cache("tokens", settings.token_cache_size, ttl=0, shared=False)
+
+
 def verify_access_token(raw_token: str, credential_exception):
+    token_data = token_cache.get(raw_token)
+    if token_data is not None:
+        return token_data
+    start = time.perf_counter()
     try:
         payload= jwt.decode(raw_token, SECRET_KEY, [ALGORITHM])   ## payload is a dictionary containing the data (user id) we passed while creating the token.
         user_id: str = payload.get("user_id")
@@ -38,19 +60,75 @@ def verify_access_token(raw_token: str, credential_exception):
         token_data = schemas.TokenData(id=user_id)
     except JWTError:
         raise credential_exception
+    finally:
+        jwt_seconds.labels("decode").observe(time.perf_counter() - start)
+    # Only tokens with an expiry are cached (create_access_token always adds one).
+    if "exp" in payload:
+        token_cache.set(raw_token, token_data, ttl=payload["exp"] - time.time())
     return token_data   
 # token_data is nothing but the id of the user making request. We can return multiple fields if we want.
 
 
+# The caller as far as the token tells us: just the user id, without loading the user from the database.
+# __slots__ makes it a small object with a fixed set of attributes (no __dict__).
+class Principal:
+    __slots__ = ("id",)
+
+    def __init__(self, id: int):
+        self.id = id
+
+
+# Use this instead of get_current_user when the route only needs the id of the caller (e.g. to set owner_id
+# or to check that the caller owns a post). The token signature and expiry are still verified,
+# but there is no users query, so a deleted user keeps access until the token expires.
+def get_current_principal(raw_token: str = Depends(oauth2_scheme)):
+    credential_exception= HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Could not validate credentials", headers={"WWW-Authenticate": "Bearer"})
+    decoded_token= verify_access_token(raw_token, credential_exception)
+    return Principal(decoded_token.id)
+
+
+# Logged in users by id, so that we don't query the users table on every authenticated request.
+# update_user in app/routers/user.py deletes the entry when the user changes.
+user_cache = build_cache("users", settings.user_cache_size, settings.user_cache_ttl)
+
+
 def get_current_user(raw_token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
     credential_exception= HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Could not validate credentials", headers={"WWW-Authenticate": "Bearer"})
     decoded_token= verify_access_token(raw_token, credential_exception)
+    cached_user = user_cache.get(decoded_token.id)
+    if cached_user is not None:
+        return schemas.UserOut(**cached_user)
+
     user=db.query(models.User).filter(models.User.id==decoded_token.id).first()
-    return user  
-#it will return a user or current_user object which contain all the information and we can access them by user.id or user.email.
+    if user is None:   # the token is valid but the user has been deleted.
+        raise credential_exception
+    return cache_user(user)
+#it will return a current_user object (schemas.UserOut) which contain the id, email and created_at of the user and we can access them by user.id or user.email.
+
+
+# We cache and return schemas.UserOut instead of the ORM object, because an ORM object
+# belongs to the session of the request that loaded it and can't be shared between requests.
+def cache_user(user: models.User):
+    current_user = schemas.UserOut.model_validate(user)
+    user_cache.set(current_user.id, current_user.model_dump(mode="json"))
+    return current_user
 # status_code=status.HTTP_401_UNAUTHORIZED will produce  "detail": "Not authenticated" if token is not provided.
 # status_code=status.HTTP_401_UNAUTHORIZED will produce  "detail="Could not validate credentials" if token is not correct or expired.
 
+
+# Same as get_current_user but for the async routes (DATABASE_ASYNC=true).
+async def get_current_user_async(raw_token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_async_db)):
+    credential_exception= HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Could not validate credentials", headers={"WWW-Authenticate": "Bearer"})
+    decoded_token= verify_access_token(raw_token, credential_exception)
+    cached_user = user_cache.get(decoded_token.id)
+    if cached_user is not None:
+        return schemas.UserOut(**cached_user)
+
+    user= await db.get(models.User, decoded_token.id)
+    if user is None:
+        raise credential_exception
+    return cache_user(user)
+
 '''
 raw_token:
 This variable now clearly indicates that it holds the raw JWT token extracted from the Authorization header.
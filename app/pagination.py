@@ -0,0 +1,60 @@
+import base64
+import json
+from datetime import datetime
+from fastapi import HTTPException, status
+
+'''
+Keyset (cursor) pagination helpers.
+
+With limit/offset the database still has to build and throw away every row before the offset,
+so deep pages get slower and slower. With keyset pagination the client sends back the sort key of
+the last row it has seen and we continue with "WHERE key < last_key", which an index can jump to directly.
+The cursor is just that sort key, base64 encoded so that clients treat it as an opaque string.
+'''
+
+
+def encode_cursor(*values):
+    raw = [value.isoformat() if isinstance(value, datetime) else value for value in values]
+    return base64.urlsafe_b64encode(json.dumps(raw).encode()).decode()
+
+
+# converters are applied to the decoded values in order, e.g. decode_cursor(cursor, datetime.fromisoformat, int)
+def decode_cursor(cursor: str, *converters):
+    try:
+        raw = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if not isinstance(raw, list) or len(raw) != len(converters):
+            raise ValueError("cursor has the wrong shape")
+        return [convert(value) for convert, value in zip(converters, raw)]
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+
+
+# LIKE pattern for "starts with prefix": %, _ and \ in the prefix are escaped so they match themselves.
+# The pattern is built here (not with || '%' in SQL) so postgres sees a constant prefix and can use an index.
+def prefix_pattern(prefix: str):
+    escaped = prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"{escaped}%"
+
+
+'''
+Total counts. COUNT(*) has to read every matching row, which takes seconds on a table of millions of rows.
+The query planner already estimates the number of rows from the table statistics (EXPLAIN shows it), for free.
+So for big results we send the estimate (a few % off, which is fine for "about 1.2M users"), and only small results
+are counted exactly.
+'''
+
+
+# EXPLAIN of a select() as a driver level statement (sql, parameters), so the parameters are passed by the driver
+# exactly like for the real query (%(name)s for psycopg2, $1 for asyncpg).
+def explain_statement(statement, dialect):
+    compiled = statement.compile(dialect=dialect)
+    parameters = compiled.params
+    if compiled.positional:
+        parameters = tuple(parameters[name] for name in compiled.positiontup)
+    return f"EXPLAIN (FORMAT JSON) {compiled}", parameters
+
+
+def planner_rows(plan):
+    if isinstance(plan, str):   # asyncpg returns the json as text
+        plan = json.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"])
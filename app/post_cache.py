@@ -0,0 +1,67 @@
+import json
+import time
+from fastapi import Response
+from app.cache import build_cache
+from app.serializers import dump_posts, dump_post
+from app.config import settings
+
+'''
+Cache of the JSON responses of GET /posts and GET /posts/{id}.
+
+The feed is the same for every user and only changes when a post is created, updated, deleted or voted on,
+so we keep the serialized response and send it again until one of those writes calls invalidate_posts().
+Pages of the feed are keyed by their query parameters (limit, skip, search, after), single posts by id
+(together with their ETag / Last-Modified headers, see app/conditional.py).
+Any write drops every cached page and post: the changed post may be on any page, and a change of a user (the email)
+is in all of their posts. Nothing is deleted one by one (with redis that means scanning the whole keyspace on
+every vote, or a query for the posts of the user): every key contains the current generation of the posts, and a
+write just sets a new generation. The entries of the old generation are never read again and expire by themselves.
+
+With the in-memory backend the other uvicorn workers only see a write when their entries expire
+(feed_cache_ttl), so keep the TTL short or set CACHE_REDIS_URL to share the cache.
+'''
+
+feed_cache = build_cache("feed", settings.feed_cache_size, settings.feed_cache_ttl)
+post_cache = build_cache("posts", settings.feed_cache_size, settings.feed_cache_ttl)
+# Holds one value: the generation, which is the time of the last write to the posts.
+# It lives much longer than the feed pages, so a page of an old generation can't become reachable again.
+feed_generation = build_cache("feed_generation", 1, ttl=86400)
+
+
+def current_generation():
+    return feed_generation.get("generation") or 0
+
+
+# True when the posts were written in the last database_replica_max_lag seconds: a replica may not have the write yet,
+# so what is going to be cached has to be read from the primary (see app/replicas.py).
+def written_recently(generation):
+    return time.time() - generation < settings.database_replica_max_lag
+
+
+def feed_key(generation, limit, skip, search, after):
+    return json.dumps([generation, limit, skip, search, after])
+
+
+def post_key(generation, id):
+    return json.dumps([generation, id])
+
+
+# rows are the rows of a query on app.serializers.post_columns, the result is the JSON body of the response.
+def serialize_posts(rows):
+    return dump_posts(rows).decode()
+
+
+def serialize_post(row):
+    return dump_post(row).decode()
+
+
+# page is a cached feed page: {"body": ..., "next_cursor": ...}. The body is already JSON,
+# so we send it as it is instead of letting FastAPI validate and serialize it again.
+def feed_response(page):
+    headers = {"X-Next-Cursor": page["next_cursor"]} if page["next_cursor"] else None
+    return Response(content=page["body"], media_type="application/json", headers=headers)
+
+
+# Call after the write is committed.
+def invalidate_posts():
+    feed_generation.set("generation", time.time())   # O(1), whatever the number of cached pages and posts
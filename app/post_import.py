@@ -0,0 +1,182 @@
+import csv
+import io
+import json
+from pydantic import ValidationError
+from sqlalchemy import insert
+from app import models, schemas
+from app.config import settings
+
+'''
+POST /posts/import: creates a lot of posts at once, e.g. when we move the content of another system to ours.
+
+The upload is read piece by piece (request.stream()), never as a whole, so a file of a few GB doesn't need a few GB
+of memory. Every record is validated with schemas.PostCreate, and the valid ones are saved in chunks of
+post_import_chunk_size rows:
+- with psycopg2 (postgres) a chunk is sent with COPY, which is by far the fastest way to load rows into postgres.
+- otherwise (e.g. asyncpg) it is one INSERT executed for the whole list of rows (executemany).
+Invalid records don't stop the import, they are reported with their row number in the response.
+A record longer than post_import_max_record_bytes is reported too and skipped, so a line without end or a CSV quote
+that is never closed can't make us keep the rest of the upload in memory.
+
+Two formats, chosen by the Content-Type of the request:
+- NDJSON (application/x-ndjson, the default): one JSON object per line, {"title": ..., "content": ..., "published": ...}
+- CSV (text/csv): a header line with the column names (title, content and optionally published), then one post per line.
+'''
+
+MAX_REPORTED_ERRORS = 100   # the rest are only counted, so a completely wrong file doesn't make a huge response
+
+
+class ImportReport:
+    def __init__(self):
+        self.imported = 0
+        self.error_count = 0
+        self.errors = []
+
+    def add_error(self, row: int, message: str):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"row": row, "error": message})
+
+    def as_dict(self):
+        return {"imported": self.imported, "error_count": self.error_count, "errors": self.errors}
+
+
+# A record that couldn't even be parsed (before validation).
+class InvalidRecord:
+    __slots__ = ("message",)
+
+    def __init__(self, message: str):
+        self.message = message
+
+
+# Yields the lines of the upload as bytes, or an InvalidRecord for a line longer than post_import_max_record_bytes
+# (the rest of that line is skipped). Only the chunk just received is split, and the pieces of an unfinished
+# line are joined once when its end arrives: every byte is handled once, however long the lines are.
+async def read_lines(request):
+    pending, pending_size = [], 0   # pieces of the line not finished yet
+    too_long = False                # skipping the rest of a line that is too long
+    async for chunk in request.stream():
+        *lines, rest = chunk.split(b"\n")
+        for line in lines:
+            if too_long:
+                too_long = False   # its end is here, the next line is a new one
+            elif pending_size + len(line) > settings.post_import_max_record_bytes:
+                yield InvalidRecord(f"record longer than {settings.post_import_max_record_bytes} bytes")
+            else:
+                yield b"".join(pending) + line
+            pending, pending_size = [], 0
+        if too_long:
+            continue
+        pending.append(rest)
+        pending_size += len(rest)
+        if pending_size > settings.post_import_max_record_bytes:
+            yield InvalidRecord(f"record longer than {settings.post_import_max_record_bytes} bytes")
+            pending, pending_size, too_long = [], 0, True
+    if pending_size:
+        yield b"".join(pending)
+
+
+# A CSV record can go over several lines when a quoted field contains a newline. Quotes always come in pairs
+# ("" is an escaped quote), so the record is complete once it has an even number of them. The quotes of every line
+# are counted once when it arrives, not again for every line added to the record.
+async def read_csv_records(request):
+    header = None
+    record, record_size, quotes = [], 0, 0
+    async for line in read_lines(request):
+        if isinstance(line, InvalidRecord):
+            record, record_size, quotes = [], 0, 0
+            yield line
+            continue
+        record.append(line)
+        record_size += len(line)
+        quotes += line.count(b'"')
+        if quotes % 2:
+            if record_size > settings.post_import_max_record_bytes:
+                # Most likely a quote that is never closed: drop the record, the next line starts a new one.
+                record, record_size, quotes = [], 0, 0
+                yield InvalidRecord(f"record longer than {settings.post_import_max_record_bytes} bytes (unterminated quoted field?)")
+            continue
+        values = next(csv.reader([b"\n".join(record).decode("utf-8", errors="replace")]), [])
+        record, record_size, quotes = [], 0, 0
+        if header is None:
+            header = [name.strip() for name in values]
+            continue
+        if not values:
+            yield None
+            continue
+        # An empty published column means "not given", so the default of PostCreate is used.
+        yield {name: value for name, value in zip(header, values) if not (name == "published" and value == "")}
+    if record:
+        yield InvalidRecord("unterminated quoted field")
+
+
+async def read_ndjson_records(request):
+    async for line in read_lines(request):
+        if isinstance(line, InvalidRecord):
+            yield line
+            continue
+        if not line.strip():
+            yield None
+            continue
+        try:
+            yield json.loads(line.decode("utf-8", errors="replace"))
+        except ValueError:
+            yield InvalidRecord("invalid JSON")
+
+
+def format_validation_error(error: ValidationError):
+    return "; ".join(f"{'.'.join(str(part) for part in item['loc']) or 'record'}: {item['msg']}" for item in error.errors())
+
+
+# Yields lists of valid rows (dicts of the posts columns), and adds the invalid records to the report.
+# Row numbers are the line numbers for NDJSON and the record numbers after the header for CSV.
+async def validated_chunks(request, owner_id: int, report: ImportReport):
+    content_type = request.headers.get("content-type", "")
+    records = read_csv_records(request) if content_type.startswith("text/csv") else read_ndjson_records(request)
+
+    rows = []
+    row_number = 0
+    async for record in records:
+        row_number += 1
+        if record is None:   # empty line
+            continue
+        if isinstance(record, InvalidRecord):
+            report.add_error(row_number, record.message)
+            continue
+        try:
+            post = schemas.PostCreate.model_validate(record)
+        except ValidationError as error:
+            report.add_error(row_number, format_validation_error(error))
+            continue
+        rows.append({**post.model_dump(), "owner_id": owner_id})
+        if len(rows) >= settings.post_import_chunk_size:
+            yield rows
+            rows = []
+    if rows:
+        yield rows
+
+
+def copy_posts(db, rows):
+    buffer = io.StringIO()
+    # COPY reads an unquoted empty field as NULL, so quote everything: an empty title or content stays "".
+    writer = csv.writer(buffer, quoting=csv.QUOTE_ALL)
+    for row in rows:
+        writer.writerow([row["title"], row["content"], row["published"], row["owner_id"]])
+    buffer.seek(0)
+    # The raw psycopg2 connection of the session, so the COPY is part of the same transaction as the rest.
+    cursor = db.connection().connection.cursor()
+    try:
+        cursor.copy_expert(
+            f"COPY {models.Post.__tablename__} (title, content, published, owner_id) FROM STDIN WITH (FORMAT csv)",
+            buffer
+        )
+    finally:
+        cursor.close()
+
+
+# Saves one chunk. It takes a sync Session, so the async router calls it with AsyncSession.run_sync().
+def save_posts(db, rows):
+    if db.get_bind().dialect.driver == "psycopg2":
+        copy_posts(db, rows)
+    else:
+        db.execute(insert(models.Post), rows)
@@ -0,0 +1,134 @@
+import contextvars
+import json
+import logging
+import time
+from sqlalchemy import event
+from starlette.datastructures import MutableHeaders
+from app.config import settings
+
+'''
+Per request SQL profiling (enabled with SQL_PROFILING_ENABLED=true).
+
+SQLAlchemy calls before_cursor_execute / after_cursor_execute around every statement sent to the database.
+We time each statement and add it to the profile of the request that is running, which the middleware keeps
+in a context variable (a context variable follows the request into the threadpool where the sync routes run).
+When the response starts the middleware adds the totals as a Server-Timing header (shown by the browser dev tools),
+and when the request ends it logs them as one JSON line. Statements slower than slow_query_threshold_ms
+are logged on their own as well.
+
+When profiling is disabled main.py neither registers the events nor adds the middleware, so it costs nothing.
+
+The lines go to the "app.profiling" logger. Python drops INFO records of a logger nobody configured (and uvicorn only
+configures its own loggers), so configure_logger() sets it to INFO and, when no logging is configured at all,
+writes the lines to stderr. With your own logging config, set the level of "app.profiling" to INFO there.
+'''
+
+logger = logging.getLogger("app.profiling")
+
+
+def configure_logger():
+    if logger.level == logging.NOTSET:
+        logger.setLevel(logging.INFO)
+    if not logger.handlers and not logging.getLogger().handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(message)s"))   # the messages are JSON already
+        logger.addHandler(handler)
+
+current_profile = contextvars.ContextVar("current_profile", default=None)
+
+
+class RequestProfile:
+    __slots__ = ("statements", "db_seconds", "slowest_seconds", "slowest_statement")
+
+    def __init__(self):
+        self.statements = 0
+        self.db_seconds = 0.0
+        self.slowest_seconds = 0.0
+        self.slowest_statement = None
+
+    def record(self, statement, seconds):
+        self.statements += 1
+        self.db_seconds += seconds
+        if seconds > self.slowest_seconds:
+            self.slowest_seconds = seconds
+            self.slowest_statement = statement
+
+    def server_timing(self):
+        return f'db;dur={self.db_seconds * 1000:.2f};desc="{self.statements} queries", db-slowest;dur={self.slowest_seconds * 1000:.2f}'
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    record_statement(statement, time.perf_counter() - conn.info["query_start_time"].pop())
+
+
+# A statement that fails (e.g. the foreign key violation of a vote on a missing post) never gets to
+# after_cursor_execute: take its start time off the connection here, and count it like the others.
+def handle_error(exception_context):
+    conn = exception_context.connection
+    start_times = conn.info.get("query_start_time") if conn is not None else None
+    if start_times:
+        record_statement(exception_context.statement, time.perf_counter() - start_times.pop())
+
+
+def record_statement(statement, seconds):
+    profile = current_profile.get()
+    if profile is not None:
+        profile.record(statement, seconds)
+    if seconds * 1000 >= settings.slow_query_threshold_ms:
+        logger.warning(json.dumps({"event": "slow_query", "duration_ms": round(seconds * 1000, 2), "statement": statement}))
+
+
+# For the async engine pass async_engine.sync_engine, the events are only available on the sync one.
+def instrument_engine(engine):
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", after_cursor_execute)
+    event.listen(engine, "handle_error", handle_error)
+
+
+def uninstrument_engine(engine):
+    event.remove(engine, "before_cursor_execute", before_cursor_execute)
+    event.remove(engine, "after_cursor_execute", after_cursor_execute)
+    event.remove(engine, "handle_error", handle_error)
+
+
+# Plain ASGI middleware (instead of BaseHTTPMiddleware) so it doesn't add a task per request or buffer the response.
+class SQLProfilingMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        profile = RequestProfile()
+        token = current_profile.set(profile)
+        start = time.perf_counter()
+        status_code = 500
+
+        async def send_with_server_timing(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                MutableHeaders(scope=message).append("Server-Timing", profile.server_timing())
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_server_timing)
+        finally:
+            current_profile.reset(token)
+            logger.info(json.dumps({
+                "event": "request",
+                "method": scope["method"],
+                "path": scope["path"],
+                "status": status_code,
+                "duration_ms": round((time.perf_counter() - start) * 1000, 2),
+                "statements": profile.statements,
+                "db_ms": round(profile.db_seconds * 1000, 2),
+                "slowest_ms": round(profile.slowest_seconds * 1000, 2),
+                "slowest_statement": profile.slowest_statement,
+            }))
@@ -0,0 +1,220 @@
+import inspect
+import json
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict
+from starlette.routing import compile_path
+from app import oauth2
+from app.config import settings
+
+'''
+Rate limiting with token buckets, so one client (or a script) can't keep our workers busy on its own.
+
+Every client has a bucket of tokens per rule. A request takes one token; the bucket refills at a constant rate up to
+its capacity. So "10/minute" allows a burst of 10 requests, then one more every 6 seconds. Without a token the
+request is answered 429 Too Many Requests right away, with Retry-After: the seconds until the next token.
+
+- The client is the user of the access token when there is a valid one, else the IP address
+  (run uvicorn with --proxy-headers behind a proxy, so the IP is the one of the client and not of the proxy).
+- rate_limits in the settings has the rules per route ("POST /login/": "10/minute", "PUT /posts/{id}": "30/minute",
+  the path as in the router); all the other routes share rate_limit_default, with one bucket per client for all of them,
+  except rate_limit_exempt_paths (/metrics) which are never limited.
+- MemoryBuckets keeps the buckets in the worker process: every request is one dict lookup and a few additions,
+  and the buckets not used for a while are dropped (a bucket that had time to refill is the same as a new one).
+- RedisBuckets keeps them in redis, shared by all the workers, when RATE_LIMIT_REDIS_URL is set (pip install redis).
+  Otherwise every worker has its own buckets, so the real limit is the limit times the number of workers.
+  When redis can't be reached the requests are let through (fail open) and a warning is logged: an outage of the
+  rate limiter shouldn't become an outage of the whole API.
+'''
+
+logger = logging.getLogger("app.rate_limit")
+
+PERIODS = {"second": 1, "minute": 60, "hour": 3600, "day": 86400}
+
+
+class Rule:
+    __slots__ = ("name", "capacity", "refill_rate")
+
+    def __init__(self, name: str, limit: str):
+        # limit is like "10/minute"
+        count, period = limit.split("/")
+        self.name = name
+        self.capacity = int(count)
+        self.refill_rate = self.capacity / PERIODS[period.strip()]   # tokens per second
+
+
+class MemoryBuckets:
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._buckets = OrderedDict()   # key -> [tokens, last update, seconds to refill], the least recently used first
+        self._lock = threading.Lock()
+
+    # Takes a token when there is one. Returns the seconds to wait for the next token, 0 when the request may go on.
+    def take(self, key, rule: Rule, now: float):
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [rule.capacity, now, rule.capacity / rule.refill_rate]
+            else:
+                bucket[0] = min(rule.capacity, bucket[0] + (now - bucket[1]) * rule.refill_rate)
+                bucket[1] = now
+                self._buckets.move_to_end(key)
+            self._evict(now)
+
+            if bucket[0] >= 1:
+                bucket[0] -= 1
+                return 0
+            return (1 - bucket[0]) / rule.refill_rate
+
+    # The buckets are in the order they were last used, so the idle ones are at the front: checking the first
+    # one or two per request is enough, and costs the same however many buckets there are.
+    def _evict(self, now: float):
+        for _ in range(2):
+            if not self._buckets:
+                return
+            key, (tokens, updated, refill_seconds) = next(iter(self._buckets.items()))
+            if len(self._buckets) <= self.maxsize and now - updated < refill_seconds:
+                return
+            del self._buckets[key]
+
+    def reset(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+# The same algorithm as MemoryBuckets.take, run inside redis so two workers can't take the same token.
+TAKE_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local refill_rate = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(bucket[1]) or capacity
+local updated = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated) * refill_rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / refill_rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / refill_rate) + 1)
+return tostring(wait)
+"""
+
+
+class RedisBuckets:
+    WARNING_INTERVAL = 60   # seconds, so a redis outage logs one warning a minute and not one per request
+
+    def __init__(self, url: str):
+        import redis.asyncio   # optional dependency, only needed when RATE_LIMIT_REDIS_URL is set.
+        self._redis = redis.asyncio.Redis.from_url(url)
+        self._take = self._redis.register_script(TAKE_SCRIPT)
+        self._errors = redis.RedisError
+        self._warned_at = None
+
+    async def take(self, key, rule: Rule, now: float):
+        try:
+            # time.time() and not the monotonic clock, because the workers (and servers) have to agree on it.
+            wait = await self._take(keys=[f"fastapi:ratelimit:{json.dumps(key)}"], args=[rule.capacity, rule.refill_rate, time.time()])
+        except self._errors as error:
+            if self._warned_at is None or now - self._warned_at >= self.WARNING_INTERVAL:
+                self._warned_at = now
+                logger.warning("rate limiting disabled, redis failed: %r", error)
+            return 0
+        return float(wait)
+
+    def reset(self):
+        pass   # the keys expire by themselves
+
+
+class RateLimiter:
+    def __init__(self):
+        self.rules = {}            # "POST /login/" -> rule, found with one dict lookup
+        self.template_rules = []   # (method, regex of the path, rule) of the paths with parameters, like /posts/{id}
+        for route, limit in settings.rate_limits.items():
+            self.add_rule(route, limit)
+        self.default_rule = Rule("default", settings.rate_limit_default) if settings.rate_limit_default else None
+        self.exempt_paths = set(settings.rate_limit_exempt_paths)
+        if settings.rate_limit_redis_url:
+            self.buckets = RedisBuckets(settings.rate_limit_redis_url)
+        else:
+            self.buckets = MemoryBuckets(settings.rate_limit_max_buckets)
+
+    def add_rule(self, route: str, limit: str):
+        rule = Rule(route, limit)
+        method, path = route.split(" ", 1)
+        if "{" in path:
+            # The same path syntax and regex as the routes of FastAPI (starlette).
+            self.template_rules.append((method, compile_path(path)[0], rule))
+        else:
+            self.rules[route] = rule
+        return rule
+
+    def rule_for(self, method: str, path: str):
+        if path in self.exempt_paths:
+            return None
+        rule = self.rules.get(f"{method} {path}")
+        if rule is not None:
+            return rule
+        for rule_method, path_regex, rule in self.template_rules:
+            if rule_method == method and path_regex.match(path):
+                return rule
+        return self.default_rule
+
+    async def take(self, key, rule: Rule):
+        wait = self.buckets.take(key, rule, time.monotonic())
+        if inspect.isawaitable(wait):   # RedisBuckets
+            wait = await wait
+        return wait
+
+    def reset(self):
+        self.buckets.reset()
+
+
+limiter = RateLimiter()
+
+
+class InvalidToken(Exception):
+    pass
+
+
+def client_key(scope):
+    for name, value in scope["headers"]:
+        if name == b"authorization" and value[:7].lower() == b"bearer ":
+            try:
+                # Served from the token cache of app/oauth2.py after the first request of the token.
+                return "user", oauth2.verify_access_token(value[7:].decode("latin-1"), InvalidToken()).id
+            except InvalidToken:
+                break   # invalid token: the route will answer 401, count it against the IP.
+    client = scope.get("client")
+    return "ip", client[0] if client else "unknown"
+
+
+# Plain ASGI middleware, so a rejected request costs nothing more than the bucket update.
+class RateLimitMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        rule = limiter.rule_for(scope["method"], scope["path"])
+        if rule is not None:
+            wait = await limiter.take((rule.name, *client_key(scope)), rule)
+            if wait > 0:
+                await send({
+                    "type": "http.response.start",
+                    "status": 429,
+                    "headers": [
+                        (b"content-type", b"application/json"),
+                        (b"retry-after", str(math.ceil(wait)).encode()),
+                    ],
+                })
+                await send({"type": "http.response.body", "body": b'{"detail":"Too many requests, try again later."}'})
+                return
+        await self.app(scope, receive, send)
@@ -0,0 +1,81 @@
+import itertools
+import time
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+'''
+Read replicas: copies of the primary database, kept up to date by postgres replication, that can only be read.
+Sending the read-only requests (feed, single post, users) to them takes that load off the primary,
+which then only has to handle the writes.
+
+- ReplicaSet hands out the replicas in turn (round-robin). A replica that fails (can't connect, connection dropped)
+  is skipped for replica_retry_seconds, then tried again. When every replica is down the reads go to the primary.
+- RoutingSession is the session of get_read_db. It reads from one replica (the same one for the whole request, so all
+  its queries see the same data), but as soon as the request writes anything every statement goes to the primary:
+  the replica may not have received the write yet, and the request has to read what it just wrote.
+- The same goes for a write of another request that just happened: a response read from a replica would be cached
+  (app/post_cache.py) without the write, and served until it expires. So for database_replica_max_lag seconds
+  after a write the routes that fill the caches call use_primary().
+'''
+
+
+class ReplicaSet:
+    def __init__(self, engines, retry_seconds: float):
+        self.engines = list(engines)
+        self.retry_seconds = retry_seconds
+        self._down_until = {}
+        self._turn = itertools.count()   # next() of a count is atomic, so threads get different turns without a lock
+        for engine in self.engines:
+            event.listen(engine, "handle_error", self._on_error)
+
+    def _on_error(self, context):
+        # connection is None when the error happened while connecting.
+        if context.is_disconnect or context.connection is None:
+            self.mark_down(context.engine)
+
+    def mark_down(self, engine):
+        self._down_until[engine] = time.monotonic() + self.retry_seconds
+
+    def is_healthy(self, engine):
+        return self._down_until.get(engine, 0) <= time.monotonic()
+
+    # The next healthy replica, or None when there is none.
+    def choose(self):
+        if not self.engines:
+            return None
+        start = next(self._turn)
+        for offset in range(len(self.engines)):
+            engine = self.engines[(start + offset) % len(self.engines)]
+            if self.is_healthy(engine):
+                return engine
+        return None
+
+
+class RoutingSession(Session):
+    def __init__(self, replicas: ReplicaSet = None, **kwargs):
+        super().__init__(**kwargs)
+        self.replicas = replicas
+        self.replica = None
+        self.wrote = False
+
+    # Everything goes to the primary from now on, like after a write.
+    def use_primary(self):
+        self.wrote = True
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        # A flush (db.add / changed objects), an INSERT/UPDATE/DELETE or a SELECT ... FOR UPDATE is a write.
+        if self._flushing or getattr(clause, "is_dml", False) or getattr(clause, "_for_update_arg", None) is not None:
+            self.wrote = True
+
+        if not self.wrote and self.replicas is not None:
+            if self.replica is None or not self.replicas.is_healthy(self.replica):
+                self.replica = self.replicas.choose()
+            if self.replica is not None:
+                return self.replica
+        return super().get_bind(mapper, clause, **kwargs)   # the primary (the bind of the sessionmaker)
+
+
+# For the routes, whose session is a plain Session when there are no replicas (and in the tests).
+def use_primary(db):
+    if isinstance(db, RoutingSession):
+        db.use_primary()
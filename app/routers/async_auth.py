@@ -0,0 +1,39 @@
+from fastapi import status, HTTPException, Depends, APIRouter
+from fastapi.security.oauth2 import OAuth2PasswordRequestForm
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select
+from app.async_database import get_async_db
+from app import models, schemas, oauth2
+from app.hashing import password_hasher
+
+# Async version of app/routers/auth.py, used when DATABASE_ASYNC=true.
+router = APIRouter(prefix="/login", tags=["Authentication"])
+
+
+@router.post("/", response_model=schemas.Token)
+async def login(user_credentials: OAuth2PasswordRequestForm = Depends(OAuth2PasswordRequestForm), db: AsyncSession = Depends(get_async_db)):
+    result = await db.execute(select(models.User).filter(models.User.email == user_credentials.username))
+    user = result.scalars().first()
+
+    if user is None:
+        raise HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Invalid Credentials",
+        headers={"WWW-Authenticate": "Bearer"}
+    )
+
+    password_valid, new_hash = await password_hasher.verify_and_update_async(user_credentials.password, user.password)
+    if not password_valid:
+        raise HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Invalid Credentials",
+        headers={"WWW-Authenticate": "Bearer"}
+    )
+
+    # Re-hash with the current bcrypt cost, see app/routers/auth.py.
+    if new_hash is not None:
+        user.password = new_hash
+        await db.commit()
+
+    access_token= oauth2.create_access_token(data={"user_id": user.id})
+    return {"access_token":access_token, "token_type":"bearer"}
@@ -0,0 +1,185 @@
+from fastapi import Request, Response, status, HTTPException, Depends, APIRouter
+from app import models, schemas, oauth2, post_import, export
+from app.async_database import get_async_db
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload
+from sqlalchemy import select, or_, and_
+from typing import List, Optional
+from datetime import datetime
+from app.pagination import encode_cursor, decode_cursor
+from app.search import search_posts
+from app.post_cache import feed_cache, post_cache, feed_key, post_key, current_generation, serialize_posts, serialize_post, invalidate_posts, feed_response
+from app.serializers import post_columns, post_out
+from app.conditional import make_validators, is_not_modified, not_modified_response
+
+# Async version of app/routers/post.py, used when DATABASE_ASYNC=true. The routes and responses are the same.
+router=APIRouter( prefix="/posts", tags=["Posts"])
+
+'''
+Lazy loading (post.owner running its own query the first time we access it) doesn't work with AsyncSession,
+because the query would have to be awaited. So we load the owner in the same query with joinedload().
+'''
+
+
+async def load_post(db: AsyncSession, id: int):
+    result = await db.execute(
+        select(models.Post)
+        .options(joinedload(models.Post.owner))
+        .filter(models.Post.id == id)
+        .execution_options(populate_existing=True)   # reload even if the post is already in the session (e.g. after an update).
+    )
+    return result.scalars().first()
+
+
+@router.get("/", response_model=List[schemas.PostOut])
+async def get_posts(
+    db: AsyncSession = Depends(get_async_db),
+    current_user: oauth2.Principal = Depends(oauth2.get_current_principal),
+    limit: int = 5,
+    skip: int = 0,
+    search: Optional[str] = "",
+    after: Optional[str] = None
+):
+    key = feed_key(current_generation(), limit, skip, search, after)
+    page = feed_cache.get(key)
+    if page is None:
+        posts, next_cursor = await query_posts(db, limit, skip, search, after)
+        page = {"body": serialize_posts(posts), "next_cursor": next_cursor}
+        feed_cache.set(key, page)
+    return feed_response(page)
+
+
+async def query_posts(db: AsyncSession, limit: int, skip: int, search: Optional[str], after: Optional[str]):
+    query = select(*post_columns).join(models.User, models.User.id == models.Post.owner_id)
+
+    rank = None
+    if search:
+        query, rank = search_posts(query, search, db.bind.dialect.name)
+
+    if rank is not None and not after:
+        query = query.order_by(rank.desc())
+    else:
+        rank = None
+    query = query.order_by(models.Post.created_at.desc(), models.Post.id.desc())
+
+    if after:
+        created_at, post_id = decode_cursor(after, datetime.fromisoformat, int)
+        query = query.filter(or_(
+            models.Post.created_at < created_at,
+            and_(models.Post.created_at == created_at, models.Post.id < post_id)
+        ))
+    else:
+        query = query.offset(skip)
+
+    result = await db.execute(query.limit(limit))
+    posts = result.all()
+
+    next_cursor = None
+    if posts and len(posts) == limit and rank is None:
+        next_cursor = encode_cursor(posts[-1].created_at, posts[-1].id)
+    return posts, next_cursor
+
+
+@router.post("/", status_code=status.HTTP_201_CREATED, response_model=schemas.PostResponse)
+async def create_post(post: schemas.PostCreate, db: AsyncSession = Depends(get_async_db), current_user: oauth2.Principal = Depends(oauth2.get_current_principal)):
+    new_post=models.Post(owner_id=current_user.id, **post.model_dump())
+    db.add(new_post)
+    await db.commit()
+    invalidate_posts()
+    return await load_post(db, new_post.id)
+
+
+@router.get("/export")
+async def export_posts(db: AsyncSession = Depends(get_async_db), current_user: oauth2.Principal = Depends(oauth2.get_current_principal)):
+    statement = select(*post_columns).join(models.User, models.User.id == models.Post.owner_id).order_by(models.Post.id)
+    return export.ndjson_response(export.stream_select(db, statement, post_out), "posts.ndjson")
+
+
+@router.post("/import", response_model=schemas.PostImportResult)
+async def import_posts(request: Request, db: AsyncSession = Depends(get_async_db), current_user: oauth2.Principal = Depends(oauth2.get_current_principal)):
+    report = post_import.ImportReport()
+    async for rows in post_import.validated_chunks(request, current_user.id, report):
+        await db.run_sync(post_import.save_posts, rows)   # asyncpg has no copy_expert, so this is the executemany path.
+        report.imported += len(rows)
+    await db.commit()
+    if report.imported:
+        invalidate_posts()
+    return report.as_dict()
+
+
+@router.get("/{id}", response_model=schemas.PostOut)
+async def get_post(id: int, request: Request, db: AsyncSession = Depends(get_async_db), current_user: oauth2.Principal = Depends(oauth2.get_current_principal)):
+    key = post_key(current_generation(), id)
+    cached = post_cache.get(key)
+    if cached is None:
+        result = await db.execute(
+            select(*post_columns).join(models.User, models.User.id == models.Post.owner_id).filter(models.Post.id == id)
+        )
+        post = result.first()
+        if post is None:
+            raise HTTPException(status_code=404, detail=f"Post with id {id} not found")
+        validators = make_validators(max(post.updated_at, post.owner_updated_at), post.id, post.vote_count,
+                                     post.owner_updated_at, post.owner_email)
+        if is_not_modified(request, validators):
+            return not_modified_response(validators)
+        cached = {"body": serialize_post(post), "validators": validators}
+        post_cache.set(key, cached)
+    elif is_not_modified(request, cached["validators"]):
+        return not_modified_response(cached["validators"])
+    return Response(content=cached["body"], media_type="application/json", headers=cached["validators"])
+
+
+@router.delete("/{id}")
+async def delete_post(id: int, db: AsyncSession = Depends(get_async_db), current_user: oauth2.Principal = Depends(oauth2.get_current_principal)):
+    post = await db.get(models.Post, id)
+
+    if post is None:
+        raise HTTPException(status_code=404, detail=f"Post with id: {id} not found.")
+
+    if post.owner_id != current_user.id:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized to perform the requested action.")
+
+    await db.delete(post)
+    await db.commit()
+    invalidate_posts()
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+
+@router.put("/{id}",  status_code=status.HTTP_200_OK, response_model=schemas.PostResponse)
+async def update_post(id: int, post: schemas.PostUpdate, db: AsyncSession = Depends(get_async_db), current_user: oauth2.Principal = Depends(oauth2.get_current_principal)):
+    post_to_update = await db.get(models.Post, id)
+
+    if post_to_update is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Post with id {id} not found.")
+
+    if post_to_update.owner_id != current_user.id:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized to perform the requested action.")
+
+    post_to_update.title = post.title
+    post_to_update.content = post.content
+    post_to_update.published = post.published
+
+    await db.commit()
+    invalidate_posts()
+    return await load_post(db, id)
+
+
+@router.patch("/{id}", status_code=status.HTTP_200_OK, response_model=schemas.PostResponse)
+async def patch_post(id: int, post: schemas.PostPatch, db: AsyncSession = Depends(get_async_db), current_user: oauth2.Principal = Depends(oauth2.get_current_principal)):
+    post_to_update = await db.get(models.Post, id)
+
+    if post_to_update is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Post with id {id} not found.")
+
+    if post_to_update.owner_id != current_user.id:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized to perform the requested action.")
+
+    if post.title is not None:
+        post_to_update.title = post.title
+    if post.content is not None:
+        post_to_update.content = post.content
+    if post.published is not None:
+        post_to_update.published = post.published
+    await db.commit()
+    invalidate_posts()
+    return await load_post(db, id)
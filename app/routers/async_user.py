@@ -0,0 +1,117 @@
+from fastapi import status, HTTPException, Depends, APIRouter, Request, Response
+from app import models, schemas, oauth2, export
+from app.hashing import password_hasher
+from app.post_cache import invalidate_posts
+from app.serializers import user_columns, user_out, dump_users
+from app.conditional import make_validators, is_not_modified, not_modified_response
+from app.async_database import get_async_db
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, func
+from typing import List, Optional
+from app.config import settings
+from app.pagination import encode_cursor, decode_cursor, prefix_pattern, explain_statement, planner_rows
+
+# Async version of app/routers/user.py, used when DATABASE_ASYNC=true.
+router=APIRouter( prefix="/users", tags=["Users"])
+
+
+@router.post("/", status_code=status.HTTP_201_CREATED, response_model=schemas.UserOut)
+async def create_user(user: schemas.UserCreate, db: AsyncSession = Depends(get_async_db)):
+    user.password = await password_hasher.hash_async(user.password)
+    new_user=models.User(**user.model_dump())
+    db.add(new_user)
+    await db.commit()
+    await db.refresh(new_user)
+    return new_user
+
+
+@router.get("/", response_model=List[schemas.UserOut])
+async def get_all_users(
+    db: AsyncSession = Depends(get_async_db),
+    current_user: oauth2.Principal = Depends(oauth2.get_current_principal),
+    limit: int = settings.users_page_size,
+    after: Optional[str] = None,
+    email_prefix: Optional[str] = None
+):
+    limit = max(1, min(limit, settings.users_max_page_size))
+    statement = select(*user_columns)
+    if email_prefix:
+        statement = statement.filter(models.User.email.like(prefix_pattern(email_prefix), escape="\\"))
+
+    headers = {}
+    if not after:
+        total, estimated = await count_users(db, statement)
+        headers["X-Total-Count"] = str(total)
+        headers["X-Total-Count-Estimated"] = "true" if estimated else "false"
+    else:
+        (last_id,) = decode_cursor(after, int)
+        statement = statement.filter(models.User.id > last_id)
+
+    result = await db.execute(statement.order_by(models.User.id).limit(limit))
+    users = result.all()
+    if len(users) == limit:
+        headers["X-Next-Cursor"] = encode_cursor(users[-1].id)
+    return Response(content=dump_users(users), media_type="application/json", headers=headers)
+
+
+async def count_users(db: AsyncSession, statement):
+    if db.bind.dialect.name == "postgresql":
+        sql, parameters = explain_statement(statement, db.bind.dialect)
+        connection = await db.connection()
+        estimate = planner_rows((await connection.exec_driver_sql(sql, parameters)).scalar())
+        if estimate > settings.exact_count_threshold:
+            return estimate, True
+    result = await db.execute(select(func.count()).select_from(statement.subquery()))
+    return result.scalar(), False
+
+
+@router.get("/export")
+async def export_users(db: AsyncSession = Depends(get_async_db), current_user: oauth2.Principal = Depends(oauth2.get_current_principal)):
+    statement = select(*user_columns).order_by(models.User.id)
+    return export.ndjson_response(export.stream_select(db, statement, user_out), "users.ndjson")
+
+
+@router.get("/me", response_model=schemas.UserOut)
+async def get_current_user_details(request: Request, response: Response, current_user: schemas.UserOut = Depends(oauth2.get_current_user_async)):
+    validators = make_validators(current_user.updated_at, current_user.id)
+    if is_not_modified(request, validators):
+        return not_modified_response(validators)
+    response.headers.update(validators)
+    return current_user
+
+
+@router.get("/{id}", response_model=schemas.UserOut)
+async def get_user(id: int, db: AsyncSession = Depends(get_async_db), current_user: oauth2.Principal = Depends(oauth2.get_current_principal)):
+    result = await db.execute(select(*user_columns).filter(models.User.id == id))
+    user = result.first()
+
+    if user is None:
+        raise HTTPException(status_code=404, detail=f"User with id {id} not found")
+
+    return user
+
+
+@router.patch("/", response_model=schemas.UserOut)
+async def update_user(
+    user_update: schemas.UserUpdate,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: oauth2.Principal = Depends(oauth2.get_current_principal)
+):
+    user = await db.get(models.User, current_user.id)
+
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    email_changed = bool(user_update.email) and user_update.email != user.email   # see app/routers/user.py
+    if user_update.email:
+        user.email = user_update.email
+
+    if user_update.password:
+        user.password = await password_hasher.hash_async(user_update.password)
+
+    await db.commit()
+    await db.refresh(user)
+    oauth2.user_cache.delete(user.id)   # so the next request doesn't get the old email from the cache.
+    if email_changed:
+        invalidate_posts()
+    return user
@@ -0,0 +1,61 @@
+from fastapi import status, HTTPException, Depends, APIRouter
+from app import schemas, oauth2, votes
+from app.async_database import get_async_db
+from app.post_cache import invalidate_posts
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.exc import IntegrityError
+from typing import List
+
+# Async version of app/routers/vote.py, used when DATABASE_ASYNC=true.
+router=APIRouter( prefix="/vote", tags=["Vote"])
+
+
+@router.post("/", status_code=status.HTTP_201_CREATED)
+async def vote(vote: schemas.Vote, db: AsyncSession = Depends(get_async_db), current_user: oauth2.Principal = Depends(oauth2.get_current_principal)):
+    if (vote.dir==1):
+        try:
+            result = await db.execute(votes.add_vote_statement(current_user.id, vote.post_id))
+        except IntegrityError as error:
+            await db.rollback()
+            if votes.is_unknown_user(error):
+                raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Could not validate credentials", headers={"WWW-Authenticate": "Bearer"})
+            if votes.is_foreign_key_violation(error):
+                raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Post with id {vote.post_id} does not exist.")
+            raise
+        if not result.scalars().all():
+            await db.rollback()
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"User {current_user.id} has already voted on post {vote.post_id}")
+        await db.commit()
+        invalidate_posts()
+        return{"meessage": "Successfully added vote."}
+    else:   # vote.dir==0
+        result = await db.execute(votes.remove_votes_statement(current_user.id, [vote.post_id]))
+        if not result.scalars().all():
+            await db.rollback()
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Vote for the post not exists.")
+        await db.commit()
+        invalidate_posts()
+        return {"message": "Successfully deleted vote."}
+
+
+@router.post("/batch", response_model=List[schemas.VoteResult])
+async def vote_batch(batch: schemas.VoteBatch, db: AsyncSession = Depends(get_async_db), current_user: oauth2.Principal = Depends(oauth2.get_current_principal)):
+    to_add = [vote.post_id for vote in batch.votes if vote.dir == 1]
+    to_remove = [vote.post_id for vote in batch.votes if vote.dir == 0]
+
+    added, removed = set(), set()
+    if to_add:
+        added = set((await db.execute(votes.add_votes_statement(current_user.id, to_add))).scalars().all())
+    if to_remove:
+        removed = set((await db.execute(votes.remove_votes_statement(current_user.id, to_remove))).scalars().all())
+    changed = added | removed
+
+    existing = changed
+    if len(changed) < len(batch.votes):
+        post_ids = [vote.post_id for vote in batch.votes]
+        existing = set((await db.execute(votes.existing_posts_statement(post_ids))).scalars().all())
+    await db.commit()
+
+    if changed:
+        invalidate_posts()
+    return votes.batch_results(batch.votes, added, removed, existing)
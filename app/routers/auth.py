@@ -2,7 +2,8 @@ from fastapi import status, HTTPException, Depends, APIRouter
 from fastapi.security.oauth2 import OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session
 from app.database import get_db
-from app import models, schemas, utils, oauth2
+from app import models, schemas, oauth2
+from app.hashing import password_hasher
 
 router = APIRouter(prefix="/login", tags=["Authentication"])
 
@@ -25,13 +26,20 @@ def login(user_credentials: OAuth2PasswordRequestForm = Depends(OAuth2PasswordRe
         headers={"WWW-Authenticate": "Bearer"}
     )
 
-    if not utils.verify(user_credentials.password, user.password):
+    password_valid, new_hash = password_hasher.verify_and_update(user_credentials.password, user.password)
+    if not password_valid:
         raise HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Invalid Credentials",
         headers={"WWW-Authenticate": "Bearer"}
     )
 
+    # The stored hash was made with an old bcrypt cost. We have the plain password right now,
+    # so we store a hash with the current cost (the user doesn't notice anything).
+    if new_hash is not None:
+        user.password = new_hash
+        db.commit()
+
 
     access_token= oauth2.create_access_token(data={"user_id": user.id})
     return {"access_token":access_token, "token_type":"bearer"}
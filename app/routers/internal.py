@@ -0,0 +1,32 @@
+import secrets
+from typing import Optional
+from fastapi import APIRouter, Depends, Header, HTTPException, status
+from app import database, cache
+from app.config import settings
+
+
+# The pool and cache numbers tell a lot about our traffic, so they are not public: the endpoints don't exist
+# without INTERNAL_TOKEN in the settings, and need the header X-Internal-Token with it.
+def require_internal_token(x_internal_token: Optional[str] = Header(None)):
+    if not settings.internal_token:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+    # compare_digest takes the same time wherever the strings differ, so the token can't be guessed from the timing.
+    if x_internal_token is None or not secrets.compare_digest(x_internal_token, settings.internal_token):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Invalid internal token")
+
+
+# Operational endpoints for us, not for the clients, so they are hidden from the docs.
+# Every uvicorn worker answers with its own numbers.
+router=APIRouter( prefix="/internal", tags=["Internal"], include_in_schema=False, dependencies=[Depends(require_internal_token)])
+
+
+# Connection pool usage, to size database_pool_size / database_max_overflow per worker.
+@router.get("/pool")
+def get_pool_status():
+    return database.pool_status()
+
+
+# Size and hit rate of every cache in app/cache.py.
+@router.get("/cache")
+def get_cache_stats():
+    return {name: named_cache.stats() for name, named_cache in cache.caches.items()}
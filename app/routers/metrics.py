@@ -0,0 +1,15 @@
+from fastapi import APIRouter, Depends
+from fastapi.responses import PlainTextResponse
+from app import metrics
+from app.routers.internal import require_internal_token
+
+# GET /metrics in the prometheus text format, for prometheus (or any compatible scraper) to collect.
+# Hidden from the docs and protected like the /internal routes (it has the same pool numbers, and our traffic per route):
+# the scraper sends the header X-Internal-Token (http_headers in the scrape config of prometheus).
+# It is not rate limited (rate_limit_exempt_paths), so the scrapes don't use up the bucket of the scraper's IP.
+router=APIRouter(tags=["Internal"], include_in_schema=False, dependencies=[Depends(require_internal_token)])
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
@@ -1,9 +1,17 @@
-from fastapi import Response, status, HTTPException, Depends, APIRouter
-from app import models, schemas, oauth2
-from app.database import  get_db
-from sqlalchemy.orm import Session
+from fastapi import Request, Response, status, HTTPException, Depends, APIRouter
+from app import models, schemas, oauth2, post_import, export
+from fastapi.concurrency import run_in_threadpool
+from app.database import  get_db, get_read_db
+from app.replicas import use_primary
+from sqlalchemy.orm import Session, joinedload
 from typing import List, Optional
-from sqlalchemy import func
+from sqlalchemy import or_, and_
+from datetime import datetime
+from app.pagination import encode_cursor, decode_cursor
+from app.search import search_posts
+from app.post_cache import feed_cache, post_cache, feed_key, post_key, current_generation, written_recently, serialize_posts, serialize_post, invalidate_posts, feed_response
+from app.serializers import post_columns, post_out
+from app.conditional import make_validators, is_not_modified, not_modified_response
 
 
 router=APIRouter( prefix="/posts", tags=["Posts"])
@@ -12,30 +20,82 @@ router=APIRouter( prefix="/posts", tags=["Posts"])
 
 
 # We are getting all the posts here.
+# Two ways to page through the posts:
+# 1. limit/skip (old way, kept for backwards compatibility).
+# 2. limit/after, where after is the cursor returned in the X-Next-Cursor header of the previous page.
+#    Every page costs the same as the first one because the database does not have to skip any rows.
 @router.get("/", response_model=List[schemas.PostOut])
 def get_posts(
-    db: Session = Depends(get_db), 
-    current_user: int = Depends(oauth2.get_current_user), 
+    db: Session = Depends(get_read_db), 
+    current_user: oauth2.Principal = Depends(oauth2.get_current_principal), 
     limit: int = 5, 
     skip: int = 0, 
-    search: Optional[str] = ""
+    search: Optional[str] = "",
+    after: Optional[str] = None
 ):
-    query = db.query(models.Post, func.count(models.Vote.user_id).label("votes"))\
-              .join(models.Vote, models.Post.id == models.Vote.post_id, isouter=True)\
-              .group_by(models.Post.id)
+    # The page is the same for every user, so it is served from the cache until a write changes the posts.
+    generation = current_generation()
+    key = feed_key(generation, limit, skip, search, after)
+    page = feed_cache.get(key)
+    if page is None:
+        if written_recently(generation):
+            use_primary(db)   # don't cache a page from a replica that doesn't have the last write yet.
+        posts, next_cursor = query_posts(db, limit, skip, search, after)
+        page = {"body": serialize_posts(posts), "next_cursor": next_cursor}
+        feed_cache.set(key, page)
+    return feed_response(page)
+
+
+def query_posts(db: Session, limit: int, skip: int, search: Optional[str], after: Optional[str]):
+    # votes come from the vote_count column which the vote route keeps up to date,
+    # so we don't have to join and count the votes table for every request.
+    # Only the columns of the response are loaded (no ORM objects), see app/serializers.py.
+    query = db.query(*post_columns).join(models.User, models.User.id == models.Post.owner_id)
 
     # First cheching if search is provided or not.
+    rank = None
     if search:
-        query = query.filter(models.Post.title.ilike(f"%{search}%"))
+        query, rank = search_posts(query, search, db.get_bind().dialect.name)
+
+    # Search results come best match first, but only with limit/skip:
+    # a cursor page has to be in the same order as the cursor, newest first.
+    if rank is not None and not after:
+        query = query.order_by(rank.desc())
+    else:
+        rank = None
+    # Newest posts first. id breaks the tie between posts created at the same time so that the order is stable.
+    query = query.order_by(models.Post.created_at.desc(), models.Post.id.desc())
+
+    if after:
+        # Continue right after the last post of the previous page.
+        created_at, post_id = decode_cursor(after, datetime.fromisoformat, int)
+        query = query.filter(or_(
+            models.Post.created_at < created_at,
+            and_(models.Post.created_at == created_at, models.Post.id < post_id)
+        ))
+    else:
+        query = query.offset(skip)
+
+    posts = query.limit(limit).all()
+
+    # A full page means there may be more posts, so we hand out the cursor of the last one
+    # (not for pages ordered by relevance, the cursor only works with the newest first order).
+    next_cursor = None
+    if posts and len(posts) == limit and rank is None:
+        next_cursor = encode_cursor(posts[-1].created_at, posts[-1].id)
+    return posts, next_cursor
+
+# The post with its owner, loaded in one query (joinedload) for the responses of create, update and patch.
+# Without joinedload, reading post.owner for the response would run a second query.
+# populate_existing reloads the post even though it is already in the session (e.g. after an update).
+def load_post(db: Session, id: int):
+    return db.query(models.Post).options(joinedload(models.Post.owner))\
+             .filter(models.Post.id == id).populate_existing().first()
 
-    # Apply pagination (limit and skip) 
-    query = query.limit(limit).offset(skip)
-    posts = query.all()
-    return posts
 
 # We are creating posts here.
 @router.post("/", status_code=status.HTTP_201_CREATED, response_model=schemas.PostResponse)
-def create_post(post: schemas.PostCreate, db: Session = Depends(get_db), current_user: int = Depends(oauth2.get_current_user)):
+def create_post(post: schemas.PostCreate, db: Session = Depends(get_db), current_user: oauth2.Principal = Depends(oauth2.get_current_principal)):
     
     # print(current_user.email)   we can get the email or id of the current user who is logged in
     new_post=models.Post(owner_id=current_user.id, **post.model_dump())  # we added owner_id to the post we want to create.
@@ -45,28 +105,65 @@ def create_post(post: schemas.PostCreate, db: Session = Depends(get_db), current
     # new_post = models.Post(**new_post_data)  # we automatically added owner_id to the post we want to create
     db.add(new_post)  
     db.commit()
-    db.refresh(new_post)   
-    return new_post
+    invalidate_posts()
+    return load_post(db, new_post.id)
   
 
+# All the posts with their owner and votes as NDJSON, streamed from a server-side cursor (see app/export.py).
+# It has to be declared before /{id}, otherwise "export" would be taken as an id.
+@router.get("/export")
+def export_posts(db: Session = Depends(get_read_db), current_user: oauth2.Principal = Depends(oauth2.get_current_principal)):
+    query = db.query(*post_columns).join(models.User, models.User.id == models.Post.owner_id).order_by(models.Post.id)
+    return export.ndjson_response(export.stream_query(db, query, post_out), "posts.ndjson")
+
+
+# Creates many posts from an NDJSON or CSV upload, see app/post_import.py.
+# The route is async to read the upload piece by piece, and the (sync) database work runs in the threadpool.
+@router.post("/import", response_model=schemas.PostImportResult)
+async def import_posts(request: Request, db: Session = Depends(get_db), current_user: oauth2.Principal = Depends(oauth2.get_current_principal)):
+    report = post_import.ImportReport()
+    async for rows in post_import.validated_chunks(request, current_user.id, report):
+        await run_in_threadpool(post_import.save_posts, db, rows)
+        report.imported += len(rows)
+    await run_in_threadpool(db.commit)   # all the valid rows are saved, or none of them if the database fails.
+    if report.imported:
+        invalidate_posts()
+    return report.as_dict()
+
+
 # We are getting a single post by passing the id of the post in the URL.
 # @router.get("/{id}", response_model=schemas.PostResponse)  # for without votes.
 @router.get("/{id}", response_model=schemas.PostOut)  
-def get_post(id: int, db: Session = Depends(get_db), current_user: int = Depends(oauth2.get_current_user)): 
+def get_post(id: int, request: Request, db: Session = Depends(get_read_db), current_user: oauth2.Principal = Depends(oauth2.get_current_principal)): 
     # post=db.query(models.Post).filter(models.Post.id==id).first()   # for without votes.
-    post = db.query(models.Post, func.count(models.Vote.user_id).label("votes")).join(models.Vote, models.Post.id == models.Vote.post_id, isouter=True).group_by(models.Post.id).filter(models.Post.id==id).first()
-    if post is None:   #or if not post:
-        raise HTTPException(status_code=404, detail=f"Post with id {id} not found")
+    generation = current_generation()
+    cached = post_cache.get(post_key(generation, id))
+    if cached is None:
+        if written_recently(generation):
+            use_primary(db)
+        # One query for the post, its owner and its votes, only the columns of the response.
+        post = db.query(*post_columns).join(models.User, models.User.id == models.Post.owner_id).filter(models.Post.id==id).first()
+        if post is None:   #or if not post:
+            raise HTTPException(status_code=404, detail=f"Post with id {id} not found")
+        # The response embeds the owner, so a change of the owner (e.g. a new email) is a new version of it too.
+        validators = make_validators(max(post.updated_at, post.owner_updated_at), post.id, post.vote_count,
+                                     post.owner_updated_at, post.owner_email)
+        if is_not_modified(request, validators):   # the client already has this version, no need to serialize it.
+            return not_modified_response(validators)
+        cached = {"body": serialize_post(post), "validators": validators}
+        post_cache.set(post_key(generation, id), cached)
+    elif is_not_modified(request, cached["validators"]):
+        return not_modified_response(cached["validators"])
     
     # if post.owner_id != current_user.id:   # This make sure that the current user(logged in) can only see or get the post created by him/her.
     #     raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized to perform the requested action.")
 
-    return post  
+    return Response(content=cached["body"], media_type="application/json", headers=cached["validators"])
 
 
 # We are deleting the post with particular id here.
 @router.delete("/{id}")
-def delete_post(id: int, db: Session = Depends(get_db), current_user: int = Depends(oauth2.get_current_user)):
+def delete_post(id: int, db: Session = Depends(get_db), current_user: oauth2.Principal = Depends(oauth2.get_current_principal)):
     post=db.query(models.Post).filter(models.Post.id==id).first()
    
     if post is None:
@@ -77,13 +174,14 @@ def delete_post(id: int, db: Session = Depends(get_db), current_user: int = Depe
 
     db.delete(post)
     db.commit()
+    invalidate_posts()
     return Response(status_code=status.HTTP_204_NO_CONTENT)
 
 
 
 # We are updating the post with particular id here.
 @router.put("/{id}",  status_code=status.HTTP_200_OK, response_model=schemas.PostResponse)
-def update_post(id: int, post: schemas.PostUpdate, db: Session = Depends(get_db), current_user: int = Depends(oauth2.get_current_user)):  
+def update_post(id: int, post: schemas.PostUpdate, db: Session = Depends(get_db), current_user: oauth2.Principal = Depends(oauth2.get_current_principal)):  
     post_to_update = db.query(models.Post).filter(models.Post.id == id).first()
     
     if post_to_update is None:
@@ -98,13 +196,13 @@ def update_post(id: int, post: schemas.PostUpdate, db: Session = Depends(get_db)
     
      
     db.commit()
-    db.refresh(post_to_update)    
-    return post_to_update
+    invalidate_posts()
+    return load_post(db, id)
 
 
 # Patch request to partial update the post.
 @router.patch("/{id}", status_code=status.HTTP_200_OK, response_model=schemas.PostResponse)
-def patch_post(id: int, post: schemas.PostPatch, db: Session = Depends(get_db), current_user: int = Depends(oauth2.get_current_user)):
+def patch_post(id: int, post: schemas.PostPatch, db: Session = Depends(get_db), current_user: oauth2.Principal = Depends(oauth2.get_current_principal)):
     post_to_update = db.query(models.Post).filter(models.Post.id == id).first()
 
     if post_to_update is None:
@@ -120,6 +218,6 @@ def patch_post(id: int, post: schemas.PostPatch, db: Session = Depends(get_db),
     if post.published is not None:
         post_to_update.published = post.published
     db.commit()
-    db.refresh(post_to_update)
-    return  post_to_update
+    invalidate_posts()
+    return load_post(db, id)
 
@@ -1,8 +1,14 @@
-from fastapi import status, HTTPException, Depends, APIRouter, Body
-from app import models, schemas, utils, oauth2
-from app.database import engine, get_db
+from fastapi import status, HTTPException, Depends, APIRouter, Body, Request, Response
+from app import models, schemas, oauth2, export
+from app.hashing import password_hasher
+from app.post_cache import invalidate_posts
+from app.serializers import user_columns, user_out, dump_users
+from app.conditional import make_validators, is_not_modified, not_modified_response
+from app.database import engine, get_db, get_read_db
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
+from app.config import settings
+from app.pagination import encode_cursor, decode_cursor, prefix_pattern, explain_statement, planner_rows
 
 router=APIRouter( prefix="/users", tags=["Users"])
 # using prefix="/users" we can remove /users from every route in requests.
@@ -12,7 +18,7 @@ router=APIRouter( prefix="/users", tags=["Users"])
 @router.post("/", status_code=status.HTTP_201_CREATED, response_model=schemas.UserOut)
 def create_user(user: schemas.UserCreate ,db: Session = Depends(get_db)):
     # hash the password
-    hashed_password=utils.hash(user.password)
+    hashed_password=password_hasher.hash(user.password)
     user.password= hashed_password
     new_user=models.User(**user.model_dump())  
     db.add(new_user) 
@@ -21,25 +27,72 @@ def create_user(user: schemas.UserCreate ,db: Session = Depends(get_db)):
     return new_user
 
 
-# Retrieving all users
+# Retrieving the users, one page at a time (ordered by id).
+# limit is at most users_max_page_size. The next page is requested with after=<X-Next-Cursor of this page>.
+# email_prefix only returns the users whose email starts with it (uses the ix_users_email_pattern index).
+# The first page (no after) also has the number of matching users in X-Total-Count, see count_users.
 @router.get("/", response_model=List[schemas.UserOut])
-def get_all_users(db: Session = Depends(get_db),  current_user: int = Depends(oauth2.get_current_user)):
-    users = db.query(models.User).all()
-    return users
+def get_all_users(
+    db: Session = Depends(get_read_db),
+    current_user: oauth2.Principal = Depends(oauth2.get_current_principal),
+    limit: int = settings.users_page_size,
+    after: Optional[str] = None,
+    email_prefix: Optional[str] = None
+):
+    limit = max(1, min(limit, settings.users_max_page_size))
+    query = db.query(*user_columns)
+    if email_prefix:
+        query = query.filter(models.User.email.like(prefix_pattern(email_prefix), escape="\\"))
+
+    headers = {}
+    if not after:
+        total, estimated = count_users(db, query)
+        headers["X-Total-Count"] = str(total)
+        headers["X-Total-Count-Estimated"] = "true" if estimated else "false"
+    else:
+        (last_id,) = decode_cursor(after, int)
+        query = query.filter(models.User.id > last_id)
+
+    users = query.order_by(models.User.id).limit(limit).all()
+    if len(users) == limit:
+        headers["X-Next-Cursor"] = encode_cursor(users[-1].id)
+    return Response(content=dump_users(users), media_type="application/json", headers=headers)   # fast path, see app/serializers.py
+
+
+# Returns (count, estimated). The planner estimate is used when it says the result is big, see app/pagination.py.
+def count_users(db: Session, query):
+    if db.bind.dialect.name == "postgresql":
+        sql, parameters = explain_statement(query.statement, db.bind.dialect)
+        estimate = planner_rows(db.connection().exec_driver_sql(sql, parameters).scalar())
+        if estimate > settings.exact_count_threshold:
+            return estimate, True
+    return query.count(), False
+
+
 
+# All the users as NDJSON, streamed from a server-side cursor instead of loading the table (see app/export.py).
+@router.get("/export")
+def export_users(db: Session = Depends(get_read_db), current_user: oauth2.Principal = Depends(oauth2.get_current_principal)):
+    query = db.query(*user_columns).order_by(models.User.id)
+    return export.ndjson_response(export.stream_query(db, query, user_out), "users.ndjson")
 
 
 # Getting the current logged in user details.
 @router.get("/me", response_model=schemas.UserOut)
-def get_current_user_details(current_user: models.User = Depends(oauth2.get_current_user)):
+def get_current_user_details(request: Request, response: Response, current_user: schemas.UserOut = Depends(oauth2.get_current_user)):
+    # Clients poll this, so we answer 304 without a body when their copy is still current.
+    validators = make_validators(current_user.updated_at, current_user.id)
+    if is_not_modified(request, validators):
+        return not_modified_response(validators)
+    response.headers.update(validators)
     return current_user
 
 
 
 # Retreving a user with id
 @router.get("/{id}", response_model=schemas.UserOut)
-def get_user(id: int, db: Session = Depends(get_db), current_user: int = Depends(oauth2.get_current_user)):
-    user= db.query(models.User).filter(models.User.id == id).first()
+def get_user(id: int, db: Session = Depends(get_read_db), current_user: oauth2.Principal = Depends(oauth2.get_current_principal)):
+    user= db.query(*user_columns).filter(models.User.id == id).first()
 
     if user is None:
         raise HTTPException(status_code=404, detail=f"User with id {id} not found")
@@ -53,7 +106,7 @@ def get_user(id: int, db: Session = Depends(get_db), current_user: int = Depends
 def update_user(
     user_update: schemas.UserUpdate, 
     db: Session = Depends(get_db),
-    current_user: int = Depends(oauth2.get_current_user)
+    current_user: oauth2.Principal = Depends(oauth2.get_current_principal)
 ):
     user_query = db.query(models.User).filter(models.User.id == current_user.id)
     user = user_query.first()
@@ -61,13 +114,19 @@ def update_user(
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
+    # Only a new email changes the posts of the user as they are shown (the owner is in every post response).
+    # A new password only moves the owner's updated_at, which the cached posts show until they expire.
+    email_changed = bool(user_update.email) and user_update.email != user.email
     if user_update.email:
         user.email = user_update.email
 
     if user_update.password:
-        hashed_password = utils.hash(user_update.password)
+        hashed_password = password_hasher.hash(user_update.password)
         user.password = hashed_password
 
     db.commit()
     db.refresh(user)
+    oauth2.user_cache.delete(user.id)   # so the next request doesn't get the old email from the cache.
+    if email_changed:
+        invalidate_posts()   # a new generation for every cached post and feed page, see app/post_cache.py
     return user
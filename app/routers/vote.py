@@ -1,7 +1,10 @@
 from fastapi import Response, status, HTTPException, Depends, APIRouter
-from app import models, schemas, oauth2
+from app import schemas, oauth2, votes
 from app.database import  get_db
+from app.post_cache import invalidate_posts
 from sqlalchemy.orm import Session
+from sqlalchemy.exc import IntegrityError
+from typing import List
 
 
 router=APIRouter( prefix="/vote", tags=["Vote"])
@@ -20,26 +23,51 @@ dir: 0
 
 
 @router.post("/", status_code=status.HTTP_201_CREATED)
-def vote(vote: schemas.Vote, db: Session = Depends(get_db), current_user: int = Depends(oauth2.get_current_user) ):
-    
-    
-    post = db.query(models.Post).filter(models.Post.id == vote.post_id).first()
-    if not post:   # or if post is none:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Post with id {vote.post_id} does not exist.")
-
-    vote_query= db.query(models.Vote).filter(models.Vote.post_id == vote.post_id, models.Vote.user_id == current_user.id)  #Check if vote already exists.
-    found_vote= vote_query.first()
+def vote(vote: schemas.Vote, db: Session = Depends(get_db), current_user: oauth2.Principal = Depends(oauth2.get_current_principal) ):
+    # The vote and the vote_count of the post are changed by one statement, see app/votes.py.
     if (vote.dir==1):
-        if found_vote:    # If vote already exists, raise an error.
+        try:
+            added = db.execute(votes.add_vote_statement(current_user.id, vote.post_id)).scalars().all()
+        except IntegrityError as error:
+            db.rollback()
+            if votes.is_unknown_user(error):
+                raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Could not validate credentials", headers={"WWW-Authenticate": "Bearer"})
+            if votes.is_foreign_key_violation(error):
+                raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Post with id {vote.post_id} does not exist.")
+            raise
+        if not added:   # ON CONFLICT DO NOTHING: the vote already exists (maybe inserted by a request running at the same time).
+            db.rollback()
             raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"User {current_user.id} has already voted on post {vote.post_id}")
-        new_vote=models.Vote(post_id = vote.post_id, user_id = current_user.id)
-        db.add(new_vote)
         db.commit()
+        invalidate_posts()   # the cached responses have the old number of votes.
         return{"meessage": "Successfully added vote."}
     else:   # vote.dir==0
-        if found_vote is None:
+        removed = db.execute(votes.remove_votes_statement(current_user.id, [vote.post_id])).scalars().all()
+        if not removed:
+            db.rollback()
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Vote for the post not exists.")
-        vote_query.delete(synchronize_session=False)
         db.commit()
+        invalidate_posts()
         return {"message": "Successfully deleted vote."}
-    
+
+
+# Applies many votes in one transaction (e.g. the likes an app collected while offline) and tells what happened
+# to every one of them, instead of failing the whole batch for one post that was deleted or already voted on.
+@router.post("/batch", response_model=List[schemas.VoteResult])
+def vote_batch(batch: schemas.VoteBatch, db: Session = Depends(get_db), current_user: oauth2.Principal = Depends(oauth2.get_current_principal)):
+    to_add = [vote.post_id for vote in batch.votes if vote.dir == 1]
+    to_remove = [vote.post_id for vote in batch.votes if vote.dir == 0]
+
+    added = set(db.execute(votes.add_votes_statement(current_user.id, to_add)).scalars().all()) if to_add else set()
+    removed = set(db.execute(votes.remove_votes_statement(current_user.id, to_remove)).scalars().all()) if to_remove else set()
+    changed = added | removed
+
+    existing = changed
+    if len(changed) < len(batch.votes):    # tell the missing posts from the votes that had nothing to do
+        post_ids = [vote.post_id for vote in batch.votes]
+        existing = set(db.execute(votes.existing_posts_statement(post_ids)).scalars().all())
+    db.commit()
+
+    if changed:
+        invalidate_posts()
+    return votes.batch_results(batch.votes, added, removed, existing)
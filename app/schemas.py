@@ -1,6 +1,6 @@
-from pydantic import BaseModel, EmailStr, field_validator
+from pydantic import BaseModel, EmailStr, Field, field_validator
 from datetime import datetime
-from typing import Optional
+from typing import List, Optional
 
 # The below class was Post(BaseModel) before but we have changed it to PostCreate(BaseModel) to differentiate between the Post model and the PostCreate pydantic model.
 class PostCreate(BaseModel):  # It is used to validate the data that we receive in the request body. 
@@ -25,6 +25,7 @@ class UserOut(BaseModel):
     id: int
     email: str
     created_at: datetime
+    updated_at: datetime
 
     class Config:
         from_attributes= True   # or orm_mode= True
@@ -33,12 +34,25 @@ class UserOut(BaseModel):
 # This is the pydantic model for response to the user.
 # It will define how and what the data at response will look like
 
+class PostImportError(BaseModel):
+    row: int
+    error: str
+
+
+# Response of POST /posts/import.
+class PostImportResult(BaseModel):
+    imported: int
+    error_count: int
+    errors: List[PostImportError]   # at most the first 100
+
+
 class PostResponse(BaseModel):
     id: int
     title: str
     content: str
     published: bool
     created_at: datetime
+    updated_at: datetime
     owner_id: int
     owner: UserOut   # we are returning a post's owner information in form of pydantic model UserOut based on the relationship with User Class.
 
@@ -71,6 +85,7 @@ class UserOut(BaseModel):
     id: int
     email: str
     created_at: datetime
+    updated_at: datetime
 
     class Config:
         from_attributes= True   # or orm_mode= True
@@ -104,3 +119,22 @@ class Vote(BaseModel):
         if value not in [0, 1]:  # Ensure the value is either 0 or 1
             raise ValueError('dir must be either 0 or 1')
         return value
+
+
+# Body of POST /vote/batch: up to 100 votes applied in one transaction.
+class VoteBatch(BaseModel):
+    votes: List[Vote] = Field(min_length=1, max_length=100)
+
+    @field_validator('votes')
+    def check_unique_posts(cls, value):
+        # One vote per post, otherwise the result would depend on the order we apply them in.
+        if len({vote.post_id for vote in value}) != len(value):
+            raise ValueError('every post_id can only appear once in a batch')
+        return value
+
+
+# result is "added", "removed", "already_voted", "not_voted" or "post_not_found".
+class VoteResult(BaseModel):
+    post_id: int
+    dir: int
+    result: str
@@ -0,0 +1,28 @@
+from sqlalchemy import func, or_, literal_column
+from app import models
+
+'''
+Full text search over the title and content of the posts.
+
+title ILIKE '%word%' can't use an index (the pattern starts with %), so every search read the whole posts table.
+On postgres we search with to_tsvector(...) @@ websearch_to_tsquery(...) instead, which is answered by the GIN index
+ix_posts_search (migration 7c1e5a9d4b20), and we can order the results by relevance with ts_rank.
+websearch_to_tsquery understands what people type in a search box: words, "quoted phrases", or, -excluded.
+
+Other databases (e.g. SQLite when running the tests without postgres) don't have full text search,
+so there we fall back to ILIKE on title and content.
+'''
+
+# This expression must stay exactly the same as the one of the ix_posts_search index, otherwise postgres won't use the index.
+post_document = func.to_tsvector(literal_column("'english'"), models.Post.title + literal_column("' '") + models.Post.content)
+
+
+# Works for both db.query(...) and select(...). Returns the filtered query and the relevance
+# expression to order by, which is None when the database doesn't support full text search.
+def search_posts(query, search: str, dialect_name: str):
+    if dialect_name != "postgresql":
+        pattern = f"%{search}%"
+        return query.filter(or_(models.Post.title.ilike(pattern), models.Post.content.ilike(pattern))), None
+
+    search_query = func.websearch_to_tsquery(literal_column("'english'"), search)
+    return query.filter(post_document.op("@@")(search_query)), func.ts_rank(post_document, search_query)
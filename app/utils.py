@@ -1,8 +1,17 @@
 from passlib.context import CryptContext
+from app.config import settings
 
 # the version of passlib is latest but bcrypt is 4.0.1 because of some warning at terminal.
 
-pwd_context= CryptContext(schemes=["bcrypt"], deprecated="auto")  # for password hasing
+# min_rounds and max_rounds make hashes created with any other cost "need update",
+# so they are re-hashed with bcrypt_rounds the next time the user logs in (see verify_and_update).
+pwd_context= CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=settings.bcrypt_rounds,
+    bcrypt__min_rounds=settings.bcrypt_rounds,
+    bcrypt__max_rounds=settings.bcrypt_rounds,
+)  # for password hasing
 
 # function to hash the password during creating user
 def hash(password: str):
@@ -11,3 +20,8 @@ def hash(password: str):
 # function to verify the password during user login
 def verify(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
+
+# function to verify the password during user login and get a new hash if the stored one uses old settings.
+# returns (is_valid, new_hash) where new_hash is None when the stored hash is up to date.
+def verify_and_update(plain_password, hashed_password):
+    return pwd_context.verify_and_update(plain_password, hashed_password)
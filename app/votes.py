@@ -0,0 +1,122 @@
+from sqlalchemy import select, update, delete, literal
+from sqlalchemy.dialects.postgresql import insert
+from app import models
+
+'''
+The statements behind POST /vote/ and POST /vote/batch, shared by the sync and the async routers.
+
+Each one changes the votes AND the vote_count of the posts in a single statement (one round trip), with a
+"WITH ... AS (INSERT/DELETE ... RETURNING post_id) UPDATE posts ..." query:
+
+WITH changed AS (
+    INSERT INTO votes (post_id, user_id) SELECT posts.id, :user_id FROM posts WHERE posts.id IN (...)
+    ON CONFLICT DO NOTHING RETURNING votes.post_id
+)
+UPDATE posts SET vote_count = posts.vote_count + 1 FROM changed WHERE posts.id = changed.post_id RETURNING posts.id
+
+- selecting the post ids from posts skips the posts that don't exist (no foreign key error).
+- ON CONFLICT DO NOTHING skips the posts the user already voted on (no unique violation).
+- only the rows really inserted (or deleted) are returned, so only their counters are changed,
+  and the returned post ids tell the route what happened to every vote.
+
+There is no "SELECT the vote first, then INSERT it" anywhere: two requests doing that at the same time (a double
+click) both see no vote and the second INSERT fails with a unique violation. ON CONFLICT and DELETE ... RETURNING
+let the database decide which request wins, and the loser simply gets no row back.
+'''
+
+FOREIGN_KEY_VIOLATION = "23503"   # postgres error code (SQLSTATE)
+# The names postgres gave the foreign keys of votes (the migration doesn't name them).
+POST_FOREIGN_KEY = "votes_post_id_fkey"
+USER_FOREIGN_KEY = "votes_user_id_fkey"
+
+
+# The vote of POST /vote/ with dir=1. Unlike the batch it inserts the values directly, so a post that doesn't exist
+# fails the foreign key (see is_foreign_key_violation) instead of costing a lookup in posts first.
+def add_vote_statement(user_id: int, post_id: int):
+    added = (
+        insert(models.Vote)
+        .values(post_id=post_id, user_id=user_id)
+        .on_conflict_do_nothing()
+        .returning(models.Vote.post_id)
+        .cte("added")
+    )
+    return (
+        update(models.Post)
+        .where(models.Post.id == added.c.post_id)
+        .values(vote_count=models.Post.vote_count + 1)
+        .returning(models.Post.id)
+        .execution_options(synchronize_session=False)
+    )
+
+
+# psycopg2 and the asyncpg adapter of SQLAlchemy both put the SQLSTATE of the error in pgcode.
+def is_foreign_key_violation(error):
+    return getattr(error.orig, "pgcode", None) == FOREIGN_KEY_VIOLATION
+
+
+# The name of the constraint that failed: psycopg2 has it in diag, with asyncpg it is on the asyncpg error
+# that the SQLAlchemy adapter wraps (__cause__).
+def violated_constraint(error):
+    diag = getattr(error.orig, "diag", None)
+    if diag is not None:
+        return diag.constraint_name
+    return getattr(error.orig.__cause__, "constraint_name", None)
+
+
+# A vote fails the user foreign key when the user of the token was deleted after the token was made.
+def is_unknown_user(error):
+    return is_foreign_key_violation(error) and violated_constraint(error) == USER_FOREIGN_KEY
+
+
+def add_votes_statement(user_id: int, post_ids):
+    added = (
+        insert(models.Vote)
+        .from_select(
+            ["post_id", "user_id"],
+            select(models.Post.id, literal(user_id)).where(models.Post.id.in_(post_ids))
+        )
+        .on_conflict_do_nothing()
+        .returning(models.Vote.post_id)
+        .cte("added")
+    )
+    return (
+        update(models.Post)
+        .where(models.Post.id == added.c.post_id)
+        .values(vote_count=models.Post.vote_count + 1)
+        .returning(models.Post.id)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def remove_votes_statement(user_id: int, post_ids):
+    removed = (
+        delete(models.Vote)
+        .where(models.Vote.user_id == user_id, models.Vote.post_id.in_(post_ids))
+        .returning(models.Vote.post_id)
+        .cte("removed")
+    )
+    return (
+        update(models.Post)
+        .where(models.Post.id == removed.c.post_id)
+        .values(vote_count=models.Post.vote_count - 1)
+        .returning(models.Post.id)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def existing_posts_statement(post_ids):
+    return select(models.Post.id).where(models.Post.id.in_(post_ids))
+
+
+# Per vote result of a batch, from the post ids returned by the statements above.
+def batch_results(votes, added, removed, existing):
+    results = []
+    for vote in votes:
+        if vote.post_id not in existing:
+            result = "post_not_found"
+        elif vote.dir == 1:
+            result = "added" if vote.post_id in added else "already_voted"
+        else:
+            result = "removed" if vote.post_id in removed else "not_voted"
+        results.append({"post_id": vote.post_id, "dir": vote.dir, "result": result})
+    return results
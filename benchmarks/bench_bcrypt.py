@@ -0,0 +1,40 @@
+import argparse
+import time
+from passlib.context import CryptContext
+
+'''
+Time to hash one password with bcrypt for each cost (rounds) on this machine.
+Run it on the production hardware and pick the highest cost that fits the login latency budget,
+then set BCRYPT_ROUNDS. Existing users are re-hashed with the new cost when they log in.
+    python -m benchmarks.bench_bcrypt --rounds 10 11 12 13 --budget-ms 250
+'''
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark bcrypt cost levels")
+    parser.add_argument("--rounds", type=int, nargs="+", default=[10, 11, 12, 13, 14])
+    parser.add_argument("--samples", type=int, default=5, help="hashes per cost level")
+    parser.add_argument("--budget-ms", type=float, default=250, help="maximum acceptable time for one hash")
+    args = parser.parse_args()
+
+    best = None
+    print(f"{'rounds':>6}  {'ms/hash':>9}")
+    for rounds in args.rounds:
+        context = CryptContext(schemes=["bcrypt"], bcrypt__default_rounds=rounds)
+        context.hash("warm up")
+        start = time.perf_counter()
+        for _ in range(args.samples):
+            context.hash("benchmark password")
+        milliseconds = (time.perf_counter() - start) / args.samples * 1000
+        print(f"{rounds:>6}  {milliseconds:>9.1f}")
+        if milliseconds <= args.budget_ms:
+            best = rounds
+
+    if best is None:
+        print(f"no cost level fits in {args.budget_ms} ms")
+    else:
+        print(f"highest cost within {args.budget_ms} ms: BCRYPT_ROUNDS={best}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+import argparse
+import json
+import time
+from collections import namedtuple
+from datetime import datetime, timezone
+from typing import List
+from pydantic import TypeAdapter
+from app import models, schemas
+from app.serializers import post_columns, dump_posts
+
+'''
+Serialization cost of a GET /posts page: the old path (ORM objects validated against List[schemas.PostOut],
+then the json module) against the fast path (column rows dumped with orjson, app/serializers.py).
+No database is needed, the rows are built in memory. Run from the project root:
+    python -m benchmarks.bench_serialization --sizes 5 100 1000
+'''
+
+PostRow = namedtuple("PostRow", [column.key for column in post_columns])
+post_list_adapter = TypeAdapter(List[schemas.PostOut])
+
+
+def orm_rows(size, now):
+    owner = models.User(id=1, email="owner@gmail.com", password="x", created_at=now, updated_at=now)
+    return [
+        {"Post": models.Post(id=i, title=f"title {i}", content="content " * 20, published=True, created_at=now,
+                             updated_at=now, owner_id=1, owner=owner, vote_count=i), "votes": i}
+        for i in range(size)
+    ]
+
+
+def column_rows(size, now):
+    return [PostRow(i, f"title {i}", "content " * 20, True, now, now, 1, i, "owner@gmail.com", now, now) for i in range(size)]
+
+
+def old_path(rows):
+    validated = post_list_adapter.validate_python(rows, from_attributes=True)
+    return json.dumps(post_list_adapter.dump_python(validated, mode="json")).encode()
+
+
+def milliseconds_per_call(function, rows, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        function(rows)
+    return (time.perf_counter() - start) / iterations * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark serialization of GET /posts pages")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[5, 100, 1000])
+    parser.add_argument("--iterations", type=int, default=200)
+    args = parser.parse_args()
+
+    now = datetime.now(timezone.utc)
+    print(f"{'items':>6}  {'pydantic+json ms':>16}  {'orjson rows ms':>14}  {'speedup':>7}")
+    for size in args.sizes:
+        before = milliseconds_per_call(old_path, orm_rows(size, now), args.iterations)
+        after = milliseconds_per_call(dump_posts, column_rows(size, now), args.iterations)
+        print(f"{size:>6}  {before:>16.3f}  {after:>14.3f}  {before / after:>6.1f}x")
+
+
+if __name__ == "__main__":
+    main()
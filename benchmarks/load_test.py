@@ -0,0 +1,232 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+import httpx
+from sqlalchemy import text
+from app.database import engine
+from benchmarks.seed import PASSWORD, WORDS
+
+'''
+Load test of the running API: many clients at the same time calling the real endpoints, and how fast they answer.
+
+1. seed a database:      python -m benchmarks.seed --reset
+2. start the server:     RATE_LIMIT_ENABLED=false uvicorn app.main:app --workers 4
+   (without RATE_LIMIT_ENABLED=false most requests would be answered 429 by app/rate_limit.py)
+3. run the load test:    python -m benchmarks.load_test --concurrency 50 --duration 30 --output results/before.json
+
+Every client logs in as one of the seeded users, then sends requests back to back for --duration seconds,
+choosing the scenario of every request at random with the --mix weights. For every scenario it prints the number of
+requests, requests per second, errors and the p50 / p95 / p99 latency in milliseconds.
+--output saves the results (with the git commit and the arguments) as JSON, and --compare prints the difference
+with an older results file, to see if a commit made things faster or slower.
+'''
+
+# Status codes that are a normal answer for the scenario (e.g. 409 when voting twice on a post).
+EXPECTED_STATUS = {
+    "login": {200},
+    "feed": {200},
+    "feed_cursor": {200},
+    "search": {200},
+    "post": {200, 404},
+    "vote": {201, 404, 409},
+    "create": {201},
+}
+DEFAULT_MIX = ["feed=40", "feed_cursor=15", "search=15", "post=15", "vote=10", "create=4", "login=1"]
+
+
+class Results:
+    def __init__(self):
+        self.latencies = defaultdict(list)   # scenario -> seconds of every request
+        self.errors = defaultdict(lambda: defaultdict(int))   # scenario -> status -> count
+
+    def record(self, scenario, start, status):
+        self.latencies[scenario].append(time.perf_counter() - start)
+        if status not in EXPECTED_STATUS[scenario]:
+            self.errors[scenario][str(status)] += 1
+
+
+class Client:
+    def __init__(self, http, email, max_post_id, results):
+        self.http = http
+        self.email = email
+        self.max_post_id = max_post_id
+        self.results = results
+        self.cursor = None
+
+    async def request(self, scenario, method, url, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = await self.http.request(method, url, **kwargs)
+        except httpx.HTTPError as error:
+            self.results.record(scenario, start, type(error).__name__)
+            return None
+        self.results.record(scenario, start, response.status_code)
+        return response
+
+    async def login(self):
+        response = await self.request("login", "POST", "/login/", data={"username": self.email, "password": PASSWORD})
+        if response is not None and response.status_code == 200:
+            self.http.headers["Authorization"] = f"Bearer {response.json()['access_token']}"
+
+    async def feed(self):
+        await self.request("feed", "GET", "/posts/", params={"limit": 20})
+
+    # The next page of the feed, from the cursor of the previous one (back to the first page at the end).
+    async def feed_cursor(self):
+        params = {"limit": 20, "after": self.cursor} if self.cursor else {"limit": 20}
+        response = await self.request("feed_cursor", "GET", "/posts/", params=params)
+        self.cursor = response.headers.get("X-Next-Cursor") if response is not None else None
+
+    async def search(self):
+        await self.request("search", "GET", "/posts/", params={"limit": 20, "search": random.choice(WORDS)})
+
+    async def post(self):
+        await self.request("post", "GET", f"/posts/{random.randint(1, self.max_post_id)}")
+
+    async def vote(self):
+        vote = {"post_id": random.randint(1, self.max_post_id), "dir": random.choice([0, 1])}
+        await self.request("vote", "POST", "/vote/", json=vote)
+
+    async def create(self):
+        post = {"title": " ".join(random.choices(WORDS, k=3)), "content": " ".join(random.choices(WORDS, k=30))}
+        await self.request("create", "POST", "/posts/", json=post)
+
+
+def parse_mix(mix):
+    weights = {}
+    for item in mix:
+        scenario, weight = item.split("=")
+        if scenario not in EXPECTED_STATUS:
+            raise SystemExit(f"unknown scenario {scenario!r}, choose from {', '.join(EXPECTED_STATUS)}")
+        weights[scenario] = float(weight)
+    return weights
+
+
+# Nearest-rank percentile of sorted values.
+def percentile(sorted_values, percent):
+    index = max(0, min(len(sorted_values) - 1, round(percent / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def summarize(results, duration):
+    summary = {}
+    for scenario, latencies in sorted(results.latencies.items()):
+        latencies.sort()
+        summary[scenario] = {
+            "requests": len(latencies),
+            "rps": len(latencies) / duration,
+            "errors": dict(results.errors[scenario]),
+            **{f"p{percent}_ms": percentile(latencies, percent) * 1000 for percent in (50, 95, 99)},
+        }
+    total = sum(len(latencies) for latencies in results.latencies.values())
+    summary["total"] = {"requests": total, "rps": total / duration,
+                        "errors": sum(sum(errors.values()) for errors in results.errors.values())}
+    return summary
+
+
+def print_summary(summary):
+    print(f"{'scenario':<12} {'requests':>9} {'req/s':>9} {'errors':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for scenario, row in summary.items():
+        if scenario == "total":
+            continue
+        errors = sum(row["errors"].values())
+        print(f"{scenario:<12} {row['requests']:>9} {row['rps']:>9.1f} {errors:>7} "
+              f"{row['p50_ms']:>9.1f} {row['p95_ms']:>9.1f} {row['p99_ms']:>9.1f}")
+    total = summary["total"]
+    print(f"{'total':<12} {total['requests']:>9} {total['rps']:>9.1f} {total['errors']:>7}")
+
+
+# Change of req/s and p95 against an older results file, e.g. the one of the previous commit.
+def print_comparison(summary, old_path):
+    with open(old_path) as file:
+        old = json.load(file)
+    print(f"\ncompared with {old_path} (commit {old.get('commit')}):")
+    print(f"{'scenario':<12} {'req/s':>16} {'p95 ms':>16}")
+    for scenario, row in summary.items():
+        before = old["results"].get(scenario)
+        if scenario == "total" or before is None:
+            continue
+        rps_change = (row["rps"] / before["rps"] - 1) * 100 if before["rps"] else 0
+        p95_change = (row["p95_ms"] / before["p95_ms"] - 1) * 100 if before["p95_ms"] else 0
+        print(f"{scenario:<12} {row['rps']:>9.1f} {rps_change:>+5.0f}% {row['p95_ms']:>9.1f} {p95_change:>+5.0f}%")
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run_client(args, number, weights, max_post_id, results, deadline):
+    email = f"bench{number % args.users + 1}@example.com"
+    async with httpx.AsyncClient(base_url=args.url, timeout=args.timeout) as http:
+        client = Client(http, email, max_post_id, results)
+        await client.login()
+        scenarios = list(weights)
+        scenario_weights = list(weights.values())
+        while time.perf_counter() < deadline:
+            scenario = random.choices(scenarios, scenario_weights)[0]
+            await getattr(client, scenario)()
+
+
+async def run(args):
+    weights = parse_mix(args.mix)
+    random.seed(args.seed)
+
+    async with httpx.AsyncClient(base_url=args.url, timeout=args.timeout) as http:
+        response = await http.post("/login/", data={"username": "bench1@example.com", "password": PASSWORD})
+        if response.status_code != 200:
+            raise SystemExit(f"can't log in as bench1@example.com ({response.status_code}), run benchmarks.seed first")
+
+    # The post and vote scenarios pick ids up to the highest one. Not the id of the newest post of the feed:
+    # benchmarks.seed gives the posts random dates, so the newest post is not the one with the highest id.
+    max_post_id = args.max_post_id
+    if max_post_id is None:
+        with engine.connect() as connection:
+            max_post_id = connection.execute(text("SELECT max(id) FROM posts")).scalar() or 1
+
+    results = Results()
+    start = time.perf_counter()
+    deadline = start + args.duration
+    await asyncio.gather(*(run_client(args, number, weights, max_post_id, results, deadline) for number in range(args.concurrency)))
+    return summarize(results, time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the API endpoints")
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--concurrency", type=int, default=20, help="clients sending requests at the same time")
+    parser.add_argument("--duration", type=float, default=30, help="seconds")
+    parser.add_argument("--users", type=int, default=1000, help="the --users of benchmarks.seed")
+    parser.add_argument("--max-post-id", type=int, help="highest post id (default: SELECT max(id) in the database of the settings)")
+    parser.add_argument("--mix", nargs="+", default=DEFAULT_MIX, help="scenario=weight, scenarios: " + ", ".join(EXPECTED_STATUS))
+    parser.add_argument("--timeout", type=float, default=30, help="seconds before a request counts as failed")
+    parser.add_argument("--seed", type=int, default=42, help="random seed of the scenario choices")
+    parser.add_argument("--output", help="save the results as JSON to this file")
+    parser.add_argument("--compare", help="results JSON of an earlier run to compare with")
+    args = parser.parse_args()
+
+    summary = asyncio.run(run(args))
+    print_summary(summary)
+    if args.compare:
+        print_comparison(summary, args.compare)
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        with open(args.output, "w") as file:
+            json.dump({
+                "commit": git_commit(),
+                "date": datetime.now(timezone.utc).isoformat(),
+                "arguments": vars(args),
+                "results": summary,
+            }, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+import argparse
+import time
+from sqlalchemy import text
+from app.database import engine
+from app import utils
+
+'''
+Fills the database of the settings (.env) with fake users, posts and votes for benchmarks.load_test.
+Use a database made for benchmarks: --reset deletes EVERYTHING in the users, posts and votes tables first.
+Run from the project root, after `alembic upgrade head`:
+    python -m benchmarks.seed --reset --users 1000 --posts 100000 --votes 500000
+
+The rows are generated by postgres itself (generate_series), so 100k posts take seconds, not the minutes of
+inserting them through the API. The same --seed gives the same data, so two runs are comparable.
+Every user is bench<N>@example.com with the password PASSWORD.
+'''
+
+PASSWORD = "benchpassword"
+# Titles and contents are made of these words, so benchmarks.load_test can search for them.
+WORDS = ["python", "fastapi", "postgres", "index", "cache", "query", "async", "docker", "vote", "feed",
+         "latency", "replica", "cursor", "token", "bcrypt", "stream", "batch", "metrics", "pool", "search"]
+
+
+def random_words(count):
+    words = ", ".join(f"'{word}'" for word in WORDS)
+    picks = [f"(ARRAY[{words}])[1 + floor(random() * {len(WORDS)})::int]" for _ in range(count)]
+    return " || ' ' || ".join(picks)
+
+
+def seed(connection, users, posts, votes, random_seed):
+    connection.execute(text("SELECT setseed(:seed)"), {"seed": random_seed})
+
+    # One bcrypt hash for everybody: hashing 1000 passwords would take minutes and measures nothing.
+    connection.execute(text("""
+        INSERT INTO users (email, password)
+        SELECT 'bench' || n || '@example.com', :password FROM generate_series(1, :users) AS n
+    """), {"password": utils.hash(PASSWORD), "users": users})
+
+    # Spread over the last year, so the feed (newest first) and the cursors have realistic dates.
+    connection.execute(text(f"""
+        INSERT INTO posts (title, content, published, owner_id, created_at, updated_at)
+        SELECT {random_words(3)}, {random_words(30)}, random() < 0.9, owner_id, created_at, created_at
+        FROM (
+            SELECT user_ids[1 + floor(random() * array_length(user_ids, 1))::int] AS owner_id,
+                   now() - random() * interval '365 days' AS created_at
+            FROM (SELECT array_agg(id) AS user_ids FROM users) AS u, generate_series(1, :posts)
+        ) AS generated
+    """), {"posts": posts})
+
+    # Random (user, post) pairs; the duplicates are skipped, so there can be a bit less than --votes votes.
+    connection.execute(text("""
+        INSERT INTO votes (user_id, post_id)
+        SELECT user_ids[1 + floor(random() * array_length(user_ids, 1))::int],
+               post_ids[1 + floor(random() * array_length(post_ids, 1))::int]
+        FROM (SELECT array_agg(id) AS user_ids FROM users) AS u,
+             (SELECT array_agg(id) AS post_ids FROM posts) AS p,
+             generate_series(1, :votes)
+        ON CONFLICT DO NOTHING
+    """), {"votes": votes})
+    connection.execute(text("""
+        UPDATE posts SET vote_count = counts.votes
+        FROM (SELECT post_id, count(*) AS votes FROM votes GROUP BY post_id) AS counts
+        WHERE posts.id = counts.post_id
+    """))
+    connection.execute(text("ANALYZE users; ANALYZE posts; ANALYZE votes"))   # fresh statistics for the planner
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Seed the database with fake data for the load test")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--posts", type=int, default=100000)
+    parser.add_argument("--votes", type=int, default=500000)
+    parser.add_argument("--seed", type=float, default=0.42, help="between -1 and 1, passed to postgres setseed()")
+    parser.add_argument("--reset", action="store_true", help="delete all users, posts and votes first")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    with engine.begin() as connection:
+        if args.reset:
+            connection.execute(text("TRUNCATE votes, posts, users RESTART IDENTITY CASCADE"))
+        seed(connection, args.users, args.posts, args.votes, args.seed)
+    print(f"seeded {args.users} users, {args.posts} posts, up to {args.votes} votes in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,14 +2,17 @@ from fastapi.testclient import TestClient
 import pytest
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.ext.declarative import declarative_base
-from app.main import app
+from app.main import app, create_app
 
 from app.config import settings
-from app.database import get_db
+from app.database import get_db, get_read_db
+from app.async_database import get_async_db
 from app.database import Base
 from app.oauth2 import create_access_token
-from app import models
+from app import models, cache, rate_limit
 from alembic import command
 
 '''All the fixtures defined here will be accessible to all  files/packages within tests without impoerting them.'''
@@ -25,6 +28,38 @@ engine = create_engine(SQLALCHEMY_DATABASE_URL)
 TestingSessionLocal = sessionmaker(
     autocommit=False, autoflush=False, bind=engine)
 
+SQLALCHEMY_ASYNC_DATABASE_URL = SQLALCHEMY_DATABASE_URL.replace("postgresql://", "postgresql+asyncpg://", 1)
+
+
+# The routers the client fixture sends the requests to: "sync" (app/routers/post.py ...) or "async"
+# (app/routers/async_post.py ..., DATABASE_ASYNC=true). A test module that overrides this fixture with
+# @pytest.fixture(params=["sync", "async"]) runs all its tests on both.
+@pytest.fixture
+def stack():
+    return "sync"
+
+
+@pytest.fixture(scope="session")
+def async_app():
+    pytest.importorskip("asyncpg")
+    return create_app(database_async=True)
+
+
+# NullPool: the TestClient runs every request in a new event loop, and an asyncpg connection can't be used
+# from another loop than the one that opened it, so the connections can't be kept in a pool.
+@pytest.fixture(scope="session")
+def async_engine():
+    pytest.importorskip("asyncpg")
+    return create_async_engine(SQLALCHEMY_ASYNC_DATABASE_URL, poolclass=NullPool)
+
+
+# The engine the requests of the client use, e.g. to count their statements.
+@pytest.fixture
+def request_engine(session, stack, request):
+    if stack == "async":
+        return request.getfixturevalue("async_engine").sync_engine
+    return session.bind
+
 
 @pytest.fixture()
 def session():
@@ -39,7 +74,24 @@ def session():
 
 
 @pytest.fixture()
-def client(session):
+def client(session, stack, request):
+    # The database is recreated for every test, so the cached rows of the previous test are not valid anymore.
+    cache.clear_all()
+    rate_limit.limiter.reset()   # every test starts with full buckets.
+
+    if stack == "async":
+        # Every request gets its own session, the rows of the fixtures are committed so they see them.
+        AsyncTestingSessionLocal = sessionmaker(class_=AsyncSession, autoflush=False, expire_on_commit=False,
+                                                bind=request.getfixturevalue("async_engine"))
+
+        async def override_get_async_db():
+            async with AsyncTestingSessionLocal() as db:
+                yield db
+        async_app = request.getfixturevalue("async_app")
+        async_app.dependency_overrides[get_async_db] = override_get_async_db
+        yield TestClient(async_app)
+        return
+
     def override_get_db():
 
         try:
@@ -47,6 +99,7 @@ def client(session):
         finally:
             session.close()
     app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[get_read_db] = override_get_db   # no replicas in the tests, the reads use the same session.
     yield TestClient(app)
 '''
 The client fixture represents an unauthenticated user because it does not include an Authorization header with a token.
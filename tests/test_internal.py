@@ -0,0 +1,107 @@
+import json
+from app import metrics
+from app.metrics import Histogram
+from app.cache import TTLCache
+from app.config import settings
+
+
+def test_pool_status(client, monkeypatch):
+    monkeypatch.setattr(settings, "internal_token", "test-token")
+    res = client.get("/internal/pool", headers={"X-Internal-Token": "test-token"})
+    assert res.status_code == 200
+    status = res.json()
+    assert status["pools"]["primary"]["size"] >= 1
+    assert "checked_out" in status["pools"]["primary"]
+    assert "+Inf" in status["wait_seconds"]["buckets"]
+
+
+# Without INTERNAL_TOKEN the endpoints don't exist, with it they need the token.
+def test_internal_endpoints_protected(client, monkeypatch):
+    assert client.get("/internal/cache").status_code == 404
+    monkeypatch.setattr(settings, "internal_token", "test-token")
+    assert client.get("/internal/cache").status_code == 403
+    assert client.get("/internal/cache", headers={"X-Internal-Token": "wrong"}).status_code == 403
+    assert client.get("/internal/cache", headers={"X-Internal-Token": "test-token"}).status_code == 200
+
+
+# Buckets are cumulative like in prometheus: a value is counted in every bucket it fits in.
+def test_histogram_buckets():
+    histogram = Histogram(buckets=[0.1, 1])
+    for value in [0.05, 0.5, 5]:
+        histogram.observe(value)
+    snapshot = histogram.snapshot()
+    assert snapshot["buckets"] == {"0.1": 1, "1": 2, "+Inf": 3}
+    assert snapshot["count"] == 3
+
+
+def test_ttl_cache_expiry_and_lru():
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")           # "a" is now more recently used than "b"
+    cache.set("c", 3)        # so "b" is the one dropped
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+
+    cache.set("d", 4, ttl=0)
+    assert cache.get("d") is None
+    assert cache.stats()["hits"] == 2
+
+
+def test_metrics_endpoint(authorized_client, test_posts, monkeypatch):
+    monkeypatch.setattr(settings, "internal_token", "test-token")
+    authorized_client.get(f"/posts/{test_posts[0].id}")
+    assert authorized_client.get("/metrics").status_code == 403
+    res = authorized_client.get("/metrics", headers={"X-Internal-Token": "test-token"})
+    assert res.status_code == 200
+    assert res.headers["content-type"].startswith("text/plain")
+    body = res.text
+    assert "# TYPE http_request_duration_seconds histogram" in body
+    # the route label is the path template, not the url with the id in it
+    assert 'http_requests_total{method="GET",route="/posts/{id}",status="200"}' in body
+    assert 'db_pool_connections{pool="primary",state="size"}' in body
+    assert 'jwt_seconds_count{operation="decode"}' in body
+
+
+# With metrics_dir every worker writes its numbers to a file, and /metrics adds up the files of all the workers.
+def test_metrics_merged_across_workers(tmp_path, monkeypatch):
+    monkeypatch.setattr(metrics.settings, "metrics_dir", str(tmp_path))
+    other_worker = metrics.snapshot()
+    other_worker["metrics"] = {"test_total": {"help": "test", "kind": "counter", "labelnames": [], "samples": [[[], 2]]}}
+    (tmp_path / "metrics-1.json").write_text(json.dumps(other_worker))   # pid of this process, so it is "alive"
+
+    family = metrics.counter("test_total", "test")
+    family.labels().inc(3)
+    try:
+        assert "\ntest_total 5\n" in metrics.render()
+    finally:
+        del metrics.registry["test_total"]
+
+
+# A file with the pid of a live process but another start time is from a dead worker whose pid was reused:
+# its counters are still added, its gauges are not.
+def test_metrics_of_reused_pid(tmp_path, monkeypatch):
+    monkeypatch.setattr(metrics.settings, "metrics_dir", str(tmp_path))
+    dead_worker = metrics.snapshot()
+    dead_worker["started"] -= 1
+    dead_worker["metrics"] = {
+        "test_total": {"help": "test", "kind": "counter", "labelnames": [], "samples": [[[], 2]]},
+        "test_gauge": {"help": "test", "kind": "gauge", "labelnames": [], "samples": [[[], 7]]},
+    }
+    (tmp_path / "metrics-dead.json").write_text(json.dumps(dead_worker))
+    merged = metrics._merge(metrics._worker_snapshots())
+    assert merged["test_total"]["samples"][()] == 2
+    assert "test_gauge" not in merged
+
+
+# The first worker of a new server deletes the files of the previous one, the next workers keep them.
+def test_metrics_reset_for_new_master(tmp_path, monkeypatch):
+    monkeypatch.setattr(metrics.settings, "metrics_dir", str(tmp_path))
+    (tmp_path / "master").write_text("1-1")
+    (tmp_path / "metrics-12-34.json").write_text("{}")
+    metrics.reset_for_new_master()
+    assert list(tmp_path.glob("metrics-*.json")) == []
+
+    metrics.flush(force=True)
+    metrics.reset_for_new_master()
+    assert len(list(tmp_path.glob("metrics-*.json"))) == 1
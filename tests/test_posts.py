@@ -1,5 +1,15 @@
+import json
 import pytest
-from app import schemas
+from sqlalchemy import event, text
+from app import models, schemas
+from app.serializers import post_columns, post_out, dump_posts
+from app.search import search_posts
+
+
+# Every test of this module runs against the sync and the async (DATABASE_ASYNC=true) routers, see conftest.py.
+@pytest.fixture(params=["sync", "async"])
+def stack(request):
+    return request.param
 
 
 def test_get_all_posts(authorized_client, test_posts):
@@ -15,6 +25,27 @@ def test_get_all_posts(authorized_client, test_posts):
 
 
 
+# Following the X-Next-Cursor header page by page should return every post exactly once.
+def test_get_posts_with_cursor(authorized_client, test_posts):
+    seen_ids = []
+    res = authorized_client.get("/posts/", params={"limit": 3})
+    while True:
+        assert res.status_code == 200
+        seen_ids += [post["Post"]["id"] for post in res.json()]
+        cursor = res.headers.get("X-Next-Cursor")
+        if cursor is None:
+            break
+        res = authorized_client.get("/posts/", params={"limit": 3, "after": cursor})
+
+    assert sorted(seen_ids) == sorted(post.id for post in test_posts)
+    assert len(seen_ids) == len(set(seen_ids))
+
+
+def test_get_posts_invalid_cursor(authorized_client, test_posts):
+    res = authorized_client.get("/posts/", params={"after": "not-a-cursor"})
+    assert res.status_code == 400
+
+
 def test_unauthorized_user_get_all_posts(client, test_posts):
     res = client.get("/posts/")
     assert res.status_code == 401
@@ -185,3 +216,163 @@ def test_patch_post_partial_update(authorized_client, test_user, test_posts):
     assert patched_post.title == test_posts[0].title  # Title should remain unchanged
 
 
+
+
+# Search looks in the title and the content, and only returns the posts that match.
+def test_search_posts(authorized_client, test_posts):
+    res = authorized_client.get("/posts/", params={"search": "first"})
+    assert res.status_code == 200
+    assert [post["Post"]["id"] for post in res.json()] == [test_posts[0].id]
+
+    res = authorized_client.get("/posts/", params={"search": "content", "limit": 10})
+    assert len(res.json()) == len(test_posts)
+
+
+# Without postgres full text search (e.g. SQLite) search_posts falls back to a case insensitive ILIKE on title
+# and content, and there is no relevance to order by.
+def test_search_posts_ilike_fallback(session, test_posts):
+    query, relevance = search_posts(session.query(models.Post), "2ND", "sqlite")
+    assert relevance is None
+    assert [post.title for post in query.all()] == ["2nd title"]
+
+    query, relevance = search_posts(session.query(models.Post), "content", "sqlite")
+    assert len(query.all()) == len(test_posts)
+
+
+# The feed is cached, a new post must still show up in the next request.
+def test_create_post_invalidates_cached_feed(authorized_client, test_posts):
+    res = authorized_client.get("/posts/", params={"limit": 10})
+    assert len(res.json()) == len(test_posts)
+
+    authorized_client.post("/posts/", json={"title": "new title", "content": "new content"})
+
+    res = authorized_client.get("/posts/", params={"limit": 10})
+    assert len(res.json()) == len(test_posts) + 1
+
+
+# A client sending back the ETag of the post gets 304 until the post changes.
+def test_get_one_post_conditional(authorized_client, test_posts):
+    res = authorized_client.get(f"/posts/{test_posts[0].id}")
+    etag = res.headers["ETag"]
+    assert res.headers["Last-Modified"]
+
+    res = authorized_client.get(f"/posts/{test_posts[0].id}", headers={"If-None-Match": etag})
+    assert res.status_code == 304
+    assert res.content == b""
+
+    authorized_client.patch(f"/posts/{test_posts[0].id}", json={"title": "patched title"})
+    res = authorized_client.get(f"/posts/{test_posts[0].id}", headers={"If-None-Match": etag})
+    assert res.status_code == 200
+    assert res.headers["ETag"] != etag
+
+
+# The post embeds its owner: changing the owner's email is a new version of the post for the conditional requests.
+def test_get_one_post_etag_changes_with_owner(authorized_client, test_posts):
+    res = authorized_client.get(f"/posts/{test_posts[0].id}")
+    etag = res.headers["ETag"]
+
+    authorized_client.patch("/users/", json={"email": "new.owner@gmail.com"})
+    res = authorized_client.get(f"/posts/{test_posts[0].id}", headers={"If-None-Match": etag})
+    assert res.status_code == 200
+    assert res.headers["ETag"] != etag
+    assert res.json()["Post"]["owner"]["email"] == "new.owner@gmail.com"
+
+
+# The post owners are joined in the feed query, so a page costs one query however many posts and owners it has
+# (lazy loading post.owner would add one query per owner).
+def test_get_posts_statement_count_is_constant(authorized_client, request_engine, test_posts):
+    statements = []
+
+    def count_statement(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(request_engine, "before_cursor_execute", count_statement)
+    try:
+        counts = []
+        for limit in (1, len(test_posts)):
+            statements.clear()
+            res = authorized_client.get("/posts/", params={"limit": limit})
+            assert len(res.json()) == limit
+            counts.append(len(statements))
+    finally:
+        event.remove(request_engine, "before_cursor_execute", count_statement)
+
+    assert counts == [1, 1]
+
+
+# Valid rows are imported, the invalid ones are reported with their row number.
+def test_import_posts_ndjson(authorized_client, test_user, test_posts):
+    lines = [
+        '{"title": "imported 1", "content": "content 1"}',
+        '{"title": "imported 2", "content": "content 2", "published": false}',
+        '{"title": "no content"}',
+        'not json',
+    ]
+    res = authorized_client.post("/posts/import", content="\n".join(lines), headers={"Content-Type": "application/x-ndjson"})
+    assert res.status_code == 200
+    report = res.json()
+    assert report["imported"] == 2
+    assert [error["row"] for error in report["errors"]] == [3, 4]
+
+    res = authorized_client.get("/posts/", params={"limit": 10})
+    assert len(res.json()) == len(test_posts) + 2
+
+
+def test_import_posts_csv(authorized_client, test_user, test_posts):
+    body = 'title,content,published\n"csv, title","line 1\nline 2",false\nsecond,content,\n'
+    res = authorized_client.post("/posts/import", content=body, headers={"Content-Type": "text/csv"})
+    assert res.json() == {"imported": 2, "error_count": 0, "errors": []}
+
+    res = authorized_client.get("/posts/", params={"search": "csv"})
+    post = res.json()[0]["Post"]
+    assert post["content"] == "line 1\nline 2"
+    assert post["published"] is False
+    assert post["owner_id"] == test_user["id"]
+
+
+# A quote that is never closed would make the rest of the upload one record: it is cut at the maximum record size,
+# reported, and the next lines are read as new records.
+def test_import_posts_csv_unterminated_quote(authorized_client, test_user, monkeypatch):
+    monkeypatch.setattr("app.post_import.settings.post_import_max_record_bytes", 40)
+    body = 'title,content\nfirst,"never closed\nmore text\neven more text here\nsecond,content\n'
+    res = authorized_client.post("/posts/import", content=body, headers={"Content-Type": "text/csv"})
+    report = res.json()
+    assert report["imported"] == 1
+    assert report["error_count"] == 1
+    assert "longer than 40 bytes" in report["errors"][0]["error"]
+
+
+def test_unauthorized_user_import_posts(client):
+    res = client.post("/posts/import", content='{"title": "t", "content": "c"}')
+    assert res.status_code == 401
+
+
+# Every post is one JSON line with the same shape as GET /posts/{id}.
+def test_export_posts(authorized_client, test_posts, monkeypatch):
+    monkeypatch.setattr("app.export.settings.export_chunk_size", 3)   # so the posts are sent in more than one chunk
+    res = authorized_client.get("/posts/export")
+    assert res.status_code == 200
+    assert res.headers["content-type"].startswith("application/x-ndjson")
+    posts = [schemas.PostOut(**json.loads(line)) for line in res.text.splitlines()]
+    assert [post.Post.id for post in posts] == sorted(post.id for post in test_posts)
+
+
+# An empty content is valid for PostCreate, it must be saved as "" and not as NULL (which the column refuses).
+def test_import_posts_empty_content(authorized_client, test_user):
+    res = authorized_client.post("/posts/import", content='{"title": "empty", "content": ""}',
+                                 headers={"Content-Type": "application/x-ndjson"})
+    assert res.status_code == 200
+    assert res.json()["imported"] == 1
+
+    res = authorized_client.get("/posts/", params={"search": "empty"})
+    assert res.json()[0]["Post"]["content"] == ""
+
+
+# The fast serializers have to give exactly the JSON of the response_model, timestamps included
+# (with the database in UTC: "Z", like pydantic, and not "+00:00").
+def test_dump_posts_matches_schema(session, test_posts):
+    session.execute(text("SET TIME ZONE 'UTC'"))
+    rows = session.query(*post_columns).join(models.User, models.User.id == models.Post.owner_id).all()
+    expected = [schemas.PostOut.model_validate(post_out(row)).model_dump(mode="json") for row in rows]
+    assert json.loads(dump_posts(rows)) == expected
+    assert expected[0]["Post"]["created_at"].endswith("Z")
@@ -0,0 +1,65 @@
+import logging
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+from app import profiling
+
+
+# A small app with the profiling middleware around a route that runs two statements on the test database.
+def test_profiling_middleware_counts_statements(session):
+    profiled_app = FastAPI()
+    profiled_app.add_middleware(profiling.SQLProfilingMiddleware)
+
+    @profiled_app.get("/two-queries")
+    def two_queries():
+        session.execute(text("SELECT 1"))
+        session.execute(text("SELECT 2"))
+        return {}
+
+    profiling.instrument_engine(session.bind)
+    try:
+        res = TestClient(profiled_app).get("/two-queries")
+    finally:
+        profiling.uninstrument_engine(session.bind)
+
+    assert res.status_code == 200
+    assert '"2 queries"' in res.headers["Server-Timing"]
+
+
+# A statement that fails is counted too, and doesn't leave its start time on the pooled connection.
+def test_profiling_counts_failed_statement(session):
+    profiled_app = FastAPI()
+    profiled_app.add_middleware(profiling.SQLProfilingMiddleware)
+
+    connection_info = {}
+
+    @profiled_app.get("/failing-query")
+    def failing_query():
+        session.execute(text("SELECT 1"))
+        connection_info.update(info=session.connection().info)   # the info of the pooled connection
+        try:
+            session.execute(text("SELECT 1 / 0"))
+        except DBAPIError:
+            session.rollback()
+        return {}
+
+    profiling.instrument_engine(session.bind)
+    try:
+        res = TestClient(profiled_app).get("/failing-query")
+    finally:
+        profiling.uninstrument_engine(session.bind)
+
+    assert res.status_code == 200
+    assert '"2 queries"' in res.headers["Server-Timing"]
+    assert connection_info["info"]["query_start_time"] == []
+
+
+# Without any logging config the INFO summary of every request would be dropped.
+def test_profiling_logger_configured(monkeypatch):
+    monkeypatch.setattr(profiling.logger, "level", logging.NOTSET)
+    monkeypatch.setattr(profiling.logger, "handlers", [])
+    monkeypatch.setattr(logging.getLogger(), "handlers", [])
+    profiling.configure_logger()
+    assert profiling.logger.isEnabledFor(logging.INFO)
+    assert len(profiling.logger.handlers) == 1
@@ -0,0 +1,43 @@
+from sqlalchemy import text
+from app import models
+from app.search import search_posts
+
+'''
+Regression tests for the query plans of the hot queries: if a change to a query (or to the indexes) stops postgres
+from using the index, these fail. The test tables are tiny, so a sequential scan would always be cheaper;
+SET LOCAL enable_seqscan = off makes postgres use an index whenever one can answer the query.
+'''
+
+
+def explain(session, query):
+    sql = query.statement.compile(dialect=session.bind.dialect, compile_kwargs={"literal_binds": True})
+    session.execute(text("SET LOCAL enable_seqscan = off"))
+    plan = "\n".join(row[0] for row in session.execute(text(f"EXPLAIN {sql}")))
+    session.rollback()
+    return plan
+
+
+def test_feed_uses_created_at_index(session, test_posts):
+    query = session.query(models.Post, models.Post.vote_count.label("votes"))\
+                   .order_by(models.Post.created_at.desc(), models.Post.id.desc()).limit(5)
+    assert "ix_posts_created_at_id" in explain(session, query)
+
+
+def test_votes_of_post_use_post_id_index(session, test_posts):
+    query = session.query(models.Vote).filter(models.Vote.post_id == test_posts[0].id)
+    assert "ix_votes_post_id" in explain(session, query)
+
+
+def test_posts_of_owner_use_owner_id_index(session, test_posts):
+    query = session.query(models.Post).filter(models.Post.owner_id == test_posts[0].owner_id)
+    assert "ix_posts_owner_id" in explain(session, query)
+
+
+def test_email_prefix_uses_pattern_index(session, test_user):
+    query = session.query(models.User).filter(models.User.email.like("hel%"))
+    assert "ix_users_email_pattern" in explain(session, query)
+
+
+def test_search_uses_gin_index(session, test_posts):
+    query, relevance = search_posts(session.query(models.Post), "title", "postgresql")
+    assert "ix_posts_search" in explain(session, query)
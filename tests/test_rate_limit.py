@@ -0,0 +1,71 @@
+import pytest
+from app import rate_limit
+from app.config import settings
+from app.rate_limit import MemoryBuckets, Rule
+
+
+def test_token_bucket_refills():
+    buckets = MemoryBuckets(maxsize=10)
+    rule = Rule("test", "2/minute")   # one token every 30 seconds
+    assert buckets.take("client", rule, now=0) == 0
+    assert buckets.take("client", rule, now=0) == 0
+    assert buckets.take("client", rule, now=0) == 30     # empty: the next token comes in 30 seconds
+    assert buckets.take("client", rule, now=30) == 0
+
+
+# A bucket that had time to refill is dropped, it would be the same as a new one.
+def test_idle_buckets_are_evicted():
+    buckets = MemoryBuckets(maxsize=10)
+    rule = Rule("test", "2/minute")
+    buckets.take("idle", rule, now=0)
+    buckets.take("active", rule, now=59)
+    assert "idle" in buckets._buckets
+    buckets.take("active", rule, now=61)
+    assert "idle" not in buckets._buckets
+
+
+def test_login_rate_limited(client, test_user, monkeypatch):
+    monkeypatch.setitem(rate_limit.limiter.rules, "POST /login/", Rule("POST /login/", "2/minute"))
+    credentials = {"username": test_user["email"], "password": "wrong password"}
+    for _ in range(2):
+        assert client.post("/login/", data=credentials).status_code == 401
+    res = client.post("/login/", data=credentials)
+    assert res.status_code == 429
+    assert int(res.headers["Retry-After"]) == 30
+
+
+# Logged in clients have their own bucket, so they don't share the limit of their IP address.
+def test_rate_limit_per_user(authorized_client, test_posts, monkeypatch):
+    monkeypatch.setattr(rate_limit.limiter, "default_rule", Rule("default", "2/minute"))
+    for _ in range(2):
+        assert authorized_client.get("/posts/").status_code == 200
+    assert authorized_client.get("/posts/").status_code == 429
+
+    authorized_client.headers.pop("Authorization")
+    assert authorized_client.get("/").status_code == 200
+
+
+# Rules can use the path of the route, with its parameters, like in the routers.
+def test_rule_for_parametrized_route():
+    limiter = rate_limit.RateLimiter()
+    rule = limiter.add_rule("PUT /posts/{id}", "5/minute")
+    assert limiter.rule_for("PUT", "/posts/42") is rule
+    assert limiter.rule_for("GET", "/posts/42") is limiter.default_rule
+    assert limiter.rule_for("PUT", "/posts/42/comments") is limiter.default_rule
+
+
+# When redis is down the requests go through without a limit (and a warning is logged) instead of failing with 500.
+def test_redis_down_fails_open(authorized_client, test_posts, monkeypatch, caplog):
+    pytest.importorskip("redis")
+    monkeypatch.setattr(rate_limit.limiter, "buckets", rate_limit.RedisBuckets("redis://127.0.0.1:1/0"))
+    for _ in range(2):
+        assert authorized_client.get("/posts/").status_code == 200
+    assert len([record for record in caplog.records if record.name == "app.rate_limit"]) == 1
+
+
+# The prometheus scrapes don't count against the default bucket of the scraper's IP.
+def test_metrics_not_rate_limited(client, monkeypatch):
+    monkeypatch.setattr(rate_limit.limiter, "default_rule", Rule("default", "1/minute"))
+    monkeypatch.setattr(settings, "internal_token", "test-token")
+    for _ in range(3):
+        assert client.get("/metrics", headers={"X-Internal-Token": "test-token"}).status_code == 200
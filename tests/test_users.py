@@ -1,9 +1,20 @@
+import json
+import time
 import pytest
-from app import schemas
+from fastapi import HTTPException
+from app import schemas, models, post_cache
 from jose import jwt
+from passlib.context import CryptContext
 from app.config import settings
+from app.oauth2 import create_access_token, verify_access_token, token_cache
+from app.hashing import PasswordHasher
 
 
+# Every test of this module runs against the sync and the async (DATABASE_ASYNC=true) routers, see conftest.py.
+@pytest.fixture(params=["sync", "async"])
+def stack(request):
+    return request.param
+
 
 @pytest.fixture
 def test_user(client):
@@ -46,6 +57,18 @@ def test_login_user(test_user, client):
     assert res.status_code == 200
 
 
+# /users/me is served from the user cache after the first request, so update_user has to clear the cached user.
+def test_update_user_refreshes_cached_user(authorized_client):
+    res = authorized_client.get("/users/me")
+    assert res.json()["email"] == "hello@gmail.com"
+
+    res = authorized_client.patch("/users/", json={"email": "updated@gmail.com"})
+    assert res.status_code == 200
+
+    res = authorized_client.get("/users/me")
+    assert res.json()["email"] == "updated@gmail.com"
+
+
 @pytest.mark.parametrize("email, password, status_code", [
     ('wrongemail@gmail.com', 'hello123', 401),
     ('hello@gmail.com', 'wrongpassword', 401),
@@ -79,3 +102,153 @@ def test_incorrect_login(test_user, client, email, password, status_code):
 #     assert res.status_code == status_code
     # assert res.json().get('detail') == 'Invalid Credentials'
 
+
+
+# Routes that only need the caller's id trust the token (no users query), /users/me still loads the user.
+def test_token_of_deleted_user(client):
+    client.headers = {**client.headers, "Authorization": f"Bearer {create_access_token({'user_id': 88888})}"}
+    assert client.get("/posts/").status_code == 200
+    assert client.get("/users/me").status_code == 401
+
+
+# A verified token is cached until its own expiry, an expired token is rejected.
+def test_verify_access_token_cache(test_user):
+    credential_exception = HTTPException(status_code=401)
+    token = create_access_token({"user_id": test_user['id']})
+    assert verify_access_token(token, credential_exception).id == test_user['id']
+    assert token_cache.get(token).id == test_user['id']
+
+    expired_token = jwt.encode({"user_id": test_user['id'], "exp": int(time.time()) - 10}, settings.secret_key, algorithm=settings.algorithm)
+    with pytest.raises(HTTPException):
+        verify_access_token(expired_token, credential_exception)
+    assert token_cache.get(expired_token) is None
+
+
+# When every hashing slot is taken the request is rejected with 503 instead of waiting.
+def test_password_hasher_backpressure():
+    hasher = PasswordHasher(workers=0, queue_limit=0)
+    assert hasher.verify("hello123", hasher.hash("hello123"))
+
+    hasher._slots.acquire()    # another request is hashing
+    with pytest.raises(HTTPException) as error:
+        hasher.hash("hello123")
+    assert error.value.status_code == 503
+    assert error.value.headers["Retry-After"] == "1"
+
+
+# A process of the pool that dies breaks the pool: it is replaced, and the password is still verified.
+def test_password_hasher_recovers_from_broken_pool():
+    hasher = PasswordHasher(workers=1, queue_limit=1)
+    try:
+        hashed = hasher.hash("hello123")
+        executor = hasher._executor
+        for process in list(executor._processes.values()):
+            process.kill()
+            process.join()
+        assert hasher.verify("hello123", hashed)
+        assert hasher._executor is not executor
+    finally:
+        hasher.shutdown()
+
+
+# A password stored with another bcrypt cost is re-hashed with settings.bcrypt_rounds on login.
+def test_login_rehashes_old_password_hash(client, session):
+    old_rounds = 4 if settings.bcrypt_rounds != 4 else 5
+    old_hash = CryptContext(schemes=["bcrypt"], bcrypt__default_rounds=old_rounds).hash("hello123")
+    user = models.User(email="old@gmail.com", password=old_hash)
+    session.add(user)
+    session.commit()
+
+    res = client.post("/login", data={"username": "old@gmail.com", "password": "hello123"})
+    assert res.status_code == 200
+
+    user = session.query(models.User).filter(models.User.email == "old@gmail.com").first()
+    assert user.password.startswith(f"$2b${settings.bcrypt_rounds:02d}$")
+
+
+def test_get_me_conditional(authorized_client):
+    res = authorized_client.get("/users/me")
+    etag = res.headers["ETag"]
+
+    res = authorized_client.get("/users/me", headers={"If-None-Match": etag})
+    assert res.status_code == 304
+
+    authorized_client.patch("/users/", json={"email": "updated@gmail.com"})
+    res = authorized_client.get("/users/me", headers={"If-None-Match": etag})
+    assert res.status_code == 200
+
+
+def test_export_users(authorized_client, test_user, test_user2):
+    res = authorized_client.get("/users/export")
+    assert res.status_code == 200
+    users = [schemas.UserOut(**json.loads(line)) for line in res.text.splitlines()]
+    assert [user.email for user in users] == [test_user["email"], test_user2["email"]]
+
+
+@pytest.fixture
+def many_users(session, test_user):
+    session.add_all([models.User(email=f"user{number}@example.com", password="not a hash") for number in range(7)])
+    session.commit()
+
+
+# Following X-Next-Cursor returns every user once, and the first page says how many there are.
+def test_get_users_pages(authorized_client, many_users):
+    res = authorized_client.get("/users/", params={"limit": 3})
+    assert res.headers["X-Total-Count"] == "8"
+    assert res.headers["X-Total-Count-Estimated"] == "false"   # small table: counted exactly
+
+    emails = []
+    while True:
+        assert len(res.json()) <= 3
+        emails += [user["email"] for user in res.json()]
+        cursor = res.headers.get("X-Next-Cursor")
+        if cursor is None:
+            break
+        res = authorized_client.get("/users/", params={"limit": 3, "after": cursor})
+    assert len(emails) == len(set(emails)) == 8
+
+
+def test_get_users_max_page_size(authorized_client, many_users, monkeypatch):
+    monkeypatch.setattr(settings, "users_max_page_size", 2)
+    res = authorized_client.get("/users/", params={"limit": 1000})
+    assert len(res.json()) == 2
+
+
+# _ is a LIKE wildcard, it must only match itself.
+def test_get_users_email_prefix(authorized_client, many_users):
+    res = authorized_client.get("/users/", params={"email_prefix": "user1"})
+    assert [user["email"] for user in res.json()] == ["user1@example.com"]
+    assert res.headers["X-Total-Count"] == "1"
+
+    res = authorized_client.get("/users/", params={"email_prefix": "user_"})
+    assert res.json() == []
+
+
+# Above exact_count_threshold the planner estimate is sent instead of running COUNT(*).
+def test_get_users_estimated_count(authorized_client, many_users, monkeypatch):
+    monkeypatch.setattr(settings, "exact_count_threshold", -1)
+    res = authorized_client.get("/users/")
+    assert res.headers["X-Total-Count-Estimated"] == "true"
+    assert int(res.headers["X-Total-Count"]) >= 0
+
+
+# The cached post embeds the owner, so changing the email must not leave the old one in the cached response.
+def test_update_user_invalidates_cached_posts(authorized_client, test_posts):
+    res = authorized_client.get(f"/posts/{test_posts[0].id}")
+    assert res.json()["Post"]["owner"]["email"] == "hello@gmail.com"
+    authorized_client.get("/posts/", params={"limit": 10})
+
+    authorized_client.patch("/users/", json={"email": "updated@gmail.com"})
+
+    res = authorized_client.get(f"/posts/{test_posts[0].id}")
+    assert res.json()["Post"]["owner"]["email"] == "updated@gmail.com"
+    res = authorized_client.get("/posts/", params={"limit": 10})
+    owners = {post["Post"]["owner"]["email"] for post in res.json() if post["Post"]["owner_id"] == test_posts[0].owner_id}
+    assert owners == {"updated@gmail.com"}
+
+
+# A new password changes nothing that the cached posts show: they are not invalidated.
+def test_update_password_keeps_cached_posts(authorized_client, test_posts):
+    generation = post_cache.current_generation()
+    authorized_client.patch("/users/", json={"password": "new password"})
+    assert post_cache.current_generation() == generation
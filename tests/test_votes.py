@@ -1,11 +1,22 @@
 import pytest
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy.orm import sessionmaker
 from app import models
+from app.main import app
+from app.database import get_db
+
+
+# Every test of this module runs against the sync and the async (DATABASE_ASYNC=true) routers, see conftest.py.
+@pytest.fixture(params=["sync", "async"])
+def stack(request):
+    return request.param
 
 
 @pytest.fixture()
 def test_vote(test_posts, session, test_user):
     new_vote = models.Vote(post_id=test_posts[3].id, user_id=test_user['id'])
     session.add(new_vote)
+    test_posts[3].vote_count += 1    # the vote route keeps this counter in sync, so the fixture has to as well.
     session.commit()
 
 
@@ -28,6 +39,18 @@ def test_delete_vote(authorized_client, test_posts, test_vote):
     assert res.status_code == 201
 
 
+# The vote_count column should follow the votes that are added and removed.
+def test_vote_updates_vote_count(authorized_client, test_posts):
+    post_id = test_posts[3].id
+    authorized_client.post("/vote/", json={"post_id": post_id, "dir": 1})
+    res = authorized_client.get(f"/posts/{post_id}")
+    assert res.json()["votes"] == 1
+
+    authorized_client.post("/vote/", json={"post_id": post_id, "dir": 0})
+    res = authorized_client.get(f"/posts/{post_id}")
+    assert res.json()["votes"] == 0
+
+
 def test_delete_vote_non_exist(authorized_client, test_posts):
     res = authorized_client.post(
         "/vote/", json={"post_id": test_posts[3].id, "dir": 0})
@@ -40,7 +63,71 @@ def test_vote_post_non_exist(authorized_client, test_posts):
     assert res.status_code == 404
 
 
+# The token is still valid after its user was deleted, but the vote fails the user foreign key: 401, not "post not found".
+def test_vote_deleted_user(authorized_client, session, test_user, test_posts):
+    session.query(models.User).filter(models.User.id == test_user['id']).delete()
+    session.commit()
+    res = authorized_client.post(
+        "/vote/", json={"post_id": test_posts[3].id, "dir": 1})
+    assert res.status_code == 401
+
+
 def test_vote_unauthorized_user(client, test_posts):
     res = client.post(
         "/vote/", json={"post_id": test_posts[3].id, "dir": 1})
-    assert res.status_code == 401
\ No newline at end of file
+    assert res.status_code == 401
+
+# Every vote of the batch gets its own result, and the ones that can't be applied don't fail the others.
+def test_vote_batch(authorized_client, test_posts, test_vote):
+    # The ids are read now: the first request commits and closes the shared session, which expires the posts.
+    post_ids = [post.id for post in test_posts]
+    votes = [
+        {"post_id": post_ids[0], "dir": 1},
+        {"post_id": post_ids[3], "dir": 1},    # test_vote already voted on it
+        {"post_id": post_ids[1], "dir": 0},    # never voted on
+        {"post_id": 99999, "dir": 1},
+    ]
+    res = authorized_client.post("/vote/batch", json={"votes": votes})
+    assert res.status_code == 200
+    assert [vote["result"] for vote in res.json()] == ["added", "already_voted", "not_voted", "post_not_found"]
+
+    res = authorized_client.post("/vote/batch", json={"votes": [
+        {"post_id": post_ids[0], "dir": 0},
+        {"post_id": post_ids[3], "dir": 0},
+    ]})
+    assert [vote["result"] for vote in res.json()] == ["removed", "removed"]
+    assert authorized_client.get(f"/posts/{post_ids[3]}").json()["votes"] == 0
+
+
+def test_vote_batch_duplicate_post(authorized_client, test_posts):
+    votes = [{"post_id": test_posts[0].id, "dir": 1}, {"post_id": test_posts[0].id, "dir": 0}]
+    res = authorized_client.post("/vote/batch", json={"votes": votes})
+    assert res.status_code == 422
+
+
+# A double click sends the same vote twice at the same time: exactly one of them is added, the others get 409
+# (not a 500 from a unique violation) and the counter is only incremented once.
+def test_concurrent_votes_on_same_post(authorized_client, session, test_posts, monkeypatch):
+    # The client fixture shares one session between the requests, which is not safe across threads,
+    # so every request gets its own session here.
+    RequestSession = sessionmaker(autocommit=False, autoflush=False, bind=session.bind)
+
+    def override_get_db():
+        db = RequestSession()
+        try:
+            yield db
+        finally:
+            db.close()
+    monkeypatch.setitem(app.dependency_overrides, get_db, override_get_db)
+
+    post_id = test_posts[0].id
+
+    def send_vote(_):
+        return authorized_client.post("/vote/", json={"post_id": post_id, "dir": 1}).status_code
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        statuses = list(executor.map(send_vote, range(20)))
+
+    assert sorted(statuses) == [201] + [409] * 19
+    session.expire_all()
+    assert session.query(models.Post).get(post_id).vote_count == 1